@@ -99,10 +99,15 @@ ADAM_BAUDS = {
 # db = tango.Database('192.168.1.41', '10000')
 
 class Adam(TDKLambda):
+    DIO_VALID_TIME = 0.3
+
+    def __init__(self, port, addr, **kwargs):
+        # raw DI/DO word from last $AA6 and its time
+        self.dio_valid_time = kwargs.pop('dio_valid_time', Adam.DIO_VALID_TIME)
+        self.dio_word = None
+        self.dio_time = 0.0
+        super().__init__(port, addr, **kwargs)
 
-    # def __init__(self, port, addr, **kwargs):
-    #     super().__init__(port, addr, **kwargs)
-    #
     def init(self):
         self.suspend_to = 0.0
         self.pre = f'ADAMxxxx at {self.port}:{self.addr}'
@@ -127,7 +132,7 @@ class Adam(TDKLambda):
         # check device address
         if self.addr <= 0:
             self.state = -1
-            self.logger.info(f'{self.pre} ' + self.STATES[self.state])
+            self.logger.info('%s %s', self.pre, self.STATES[self.state])
             self.suspend()
             return False
         # check if port:address is in use
@@ -135,12 +140,12 @@ class Adam(TDKLambda):
             for d in TDKLambda._devices:
                 if d != self and d.port == self.port and d.addr == self.addr and d.state > 0:
                     self.state = -2
-                    self.logger.info(f'{self.pre} ' + self.STATES[self.state])
+                    self.logger.info('%s %s', self.pre, self.STATES[self.state])
                     self.suspend()
                     return False
         if not self.com.ready:
             self.state = -5
-            self.logger.info(f'{self.pre} ' + self.STATES[self.state])
+            self.logger.info('%s %s', self.pre, self.STATES[self.state])
             self.suspend()
             return False
         # read device type
@@ -160,36 +165,48 @@ class Adam(TDKLambda):
             self.name = '0000'
             for key in ADAM_DEVICES:
                 if self.id[-2:] == key[-2:]:
-                    self.logger.info(f'{self.pre} Using {key} instead of {self.id} for devise type')
+                    self.logger.info('%s Using %s instead of %s for devise type', self.pre, key, self.id)
                     self.name = key
                     break
         self.pre = f'ADAM{self.name} at {self.port}:{self.addr}'
         if self.name == '0000' or (self.name not in ADAM_DEVICES):
-            self.logger.info(f'ADAM at {self.port}:{self.addr} is not recognized')
+            self.logger.info('ADAM at %s:%s is not recognized', self.port, self.addr)
             self.state = -4
             self.suspend()
             return False
         self.ai_n = ADAM_DEVICES[self.name]['ai']
-        self.ai_masks = [True] * self.ai_n
-        if self.ai_n > 0:
-            self.ai_masks = self.read_masks()
         self.ao_n = ADAM_DEVICES[self.name]['ao']
-        self.ao_masks = [True] * self.ao_n
-        # if self.ao_n > 0:
-        #     self.ao_masks = self.read_masks()
         self.di_n = ADAM_DEVICES[self.name]['di']
         self.do_n = ADAM_DEVICES[self.name]['do']
-        self.ai_ranges = [self.read_range(c) for c in range(self.ai_n)]
+        # masks and ranges from cache are valid if module name is the same
+        cached = self.cached_identity()
+        if cached is not None and cached.get('id') == self.id and \
+                len(cached.get('ai_ranges', [])) == self.ai_n and len(cached.get('ao_ranges', [])) == self.ao_n:
+            self.ai_masks = cached['ai_masks']
+            self.ao_masks = cached['ao_masks']
+            self.ai_ranges = cached['ai_ranges']
+            self.ao_ranges = cached['ao_ranges']
+        else:
+            self.ai_masks = [True] * self.ai_n
+            if self.ai_n > 0:
+                self.ai_masks = self.read_masks()
+            self.ao_masks = [True] * self.ao_n
+            # if self.ao_n > 0:
+            #     self.ao_masks = self.read_masks()
+            self.ai_ranges = [self.read_range(c) for c in range(self.ai_n)]
+            self.ao_ranges = [self.read_range(c) for c in range(self.ao_n)]
+            if None not in self.ai_ranges and None not in self.ao_ranges:
+                self.save_identity(id=self.id, ai_masks=self.ai_masks, ao_masks=self.ao_masks,
+                                   ai_ranges=self.ai_ranges, ao_ranges=self.ao_ranges)
         self.ai_min = [i[0] for i in self.ai_ranges]
         self.ai_max = [i[1] for i in self.ai_ranges]
         self.ai_units = [i[2] for i in self.ai_ranges]
-        self.ao_ranges = [self.read_range(c) for c in range(self.ao_n)]
         self.ao_min = [i[0] for i in self.ao_ranges]
         self.ao_max = [i[1] for i in self.ao_ranges]
         self.ao_units = [i[2] for i in self.ao_ranges]
         self.state = 1
         self.suspend_to = 0.0
-        self.logger.debug(f'{self.pre} has been initialized')
+        self.logger.debug('%s has been initialized', self.pre)
         return True
 
     def _set_addr(self):
@@ -201,6 +218,12 @@ class Adam(TDKLambda):
     def verify_checksum(self, result):
         return True
 
+    def is_query(self, cmd):
+        # $AA... - configuration and state reads, #AA and #AAN - analog input reads, longer # commands write outputs
+        if isinstance(cmd, str):
+            cmd = cmd.encode()
+        return cmd.startswith(b'$') or len(cmd.rstrip(b'\r')) <= 4
+
     def send_command(self, cmd, prefix=b'$', addr=True, value=b'') -> bool:
         if isinstance(cmd, str):
             cmd = cmd.encode()
@@ -216,10 +239,9 @@ class Adam(TDKLambda):
             expected = self.head_ok
         if not response.startswith(expected):
             if response.startswith(self.head_err):
-                msg = 'Error response %s' % response
+                self.logger.info('Error response %s', response)
             else:
-                msg = 'Unexpected response %s (not %s)' % (response, expected)
-            self.logger.info(msg)
+                self.logger.info('Unexpected response %s (not %s)', response, expected)
             return False
         return True
 
@@ -235,24 +257,34 @@ class Adam(TDKLambda):
             log_exception(self.logger)
             return 'Unknown Device'
 
-    def read_di_do(self):
-        do = []
-        di = []
+    def read_dio_word(self):
+        # 16 bit DI/DO state: bits 0-7 DI, bits 8-15 DO. Cached for dio_valid_time
+        if self.dio_word is not None and time.time() - self.dio_time < self.dio_valid_time:
+            return self.dio_word
+        self.dio_word = None
         try:
             if self.send_command(b'6'):
                 if not self.response.startswith(b'!') or not self.response.endswith(b'00\r'):
                     self.logger.info('Wrong response %s', self.response)
-                    return do, di
-                val = self.response[1:-3]
-                ival = int(val, 16)
-                for i in range(self.di_n):
-                    di.append(bool(ival & (2 ** i)))
-                for i in range(self.do_n):
-                    do.append(bool(ival & (2 ** (i + 8))))
+                    return None
+                self.dio_word = int(self.response[1:-3], 16)
+                self.dio_time = time.time()
         except KeyboardInterrupt:
             raise
         except:
             log_exception(self.logger, 'Error reading DI/DO')
+        return self.dio_word
+
+    def invalidate_dio(self):
+        self.dio_word = None
+
+    def read_di_do(self):
+        do = []
+        di = []
+        ival = self.read_dio_word()
+        if ival is not None:
+            di = [bool(ival & (1 << i)) for i in range(self.di_n)]
+            do = [bool(ival & (1 << (i + 8))) for i in range(self.do_n)]
         return do, di
 
     def read_masks(self):
@@ -276,11 +308,11 @@ class Adam(TDKLambda):
         if self.di_n <= 0:
             return None
         try:
-            do, di = self.read_di_do()
             if chan is None:
-                return di
-            if len(di) > chan:
-                return di[chan]
+                return self.read_di_do()[1]
+            ival = self.read_dio_word()
+            if ival is not None and chan < self.di_n:
+                return bool(ival & (1 << chan))
             return None
         except KeyboardInterrupt:
             raise
@@ -290,11 +322,11 @@ class Adam(TDKLambda):
 
     def read_do(self, chan=None):
         try:
-            do, di = self.read_di_do()
             if chan is None:
-                return do
-            if len(do) > chan:
-                return do[chan]
+                return self.read_di_do()[0]
+            ival = self.read_dio_word()
+            if ival is not None and chan < self.do_n:
+                return bool(ival & (1 << (chan + 8)))
             return None
         except KeyboardInterrupt:
             raise
@@ -304,6 +336,7 @@ class Adam(TDKLambda):
 
     def write_do(self, chan=None, value=None):
         cmd = b'#' + self.addr_hex + (b'1%01X' % chan)
+        self.invalidate_dio()
         try:
             if self.send_command(cmd + b'0%01X' % value, prefix=b'', addr=False):
                 if self.response.startswith(b'>'):
@@ -314,6 +347,9 @@ class Adam(TDKLambda):
             raise
         except:
             log_exception(self.logger)
+        finally:
+            # a concurrent read may have cached the old DO word during the write
+            self.invalidate_dio()
 
     def read_ai(self, chan=None):
         if chan is None:
@@ -447,7 +483,7 @@ class FakeAdam(Adam):
         self.com = EmptyComPort(True)
         return self.com
 
-    def _send_command(self, cmd, terminator=None):
+    def _send_command(self, cmd, terminator=None, reset=True):
         self.command = cmd
         self.response = b''
         AA = cmd[1:3]
@@ -495,7 +531,7 @@ class FakeAdam(Adam):
         # check device address
         if self.addr <= 0:
             self.state = -1
-            self.logger.info(f'{self.pre} ' + self.STATES[self.state])
+            self.logger.info('%s %s', self.pre, self.STATES[self.state])
             self.suspend()
             return False
         # check if port:address is in use
@@ -503,12 +539,12 @@ class FakeAdam(Adam):
             for d in TDKLambda._devices:
                 if d != self and d.port == self.port and d.addr == self.addr and d.state > 0:
                     self.state = -2
-                    self.logger.info(f'{self.pre} ' + self.STATES[self.state])
+                    self.logger.info('%s %s', self.pre, self.STATES[self.state])
                     self.suspend()
                     return False
         if not self.com.ready:
             self.state = -5
-            self.logger.info(f'{self.pre} ' + self.STATES[self.state])
+            self.logger.info('%s %s', self.pre, self.STATES[self.state])
             self.suspend()
             return False
         # read device type
@@ -528,12 +564,12 @@ class FakeAdam(Adam):
             self.name = '0000'
             for key in ADAM_DEVICES:
                 if self.id[-2:] == key[-2:]:
-                    self.logger.info(f'{self.pre} Using {key} instead of {self.id} for devise type')
+                    self.logger.info('%s Using %s instead of %s for devise type', self.pre, key, self.id)
                     self.name = key
                     break
         self.pre = f'FakeADAM{self.name} at {self.port}:{self.addr}'
         if self.name == '0000' or (self.name not in ADAM_DEVICES):
-            self.logger.info(f'ADAM at {self.port}:{self.addr} is not recognized')
+            self.logger.info('ADAM at %s:%s is not recognized', self.port, self.addr)
             self.state = -4
             self.suspend()
             return False
@@ -557,7 +593,7 @@ class FakeAdam(Adam):
         self.ao_units = [i[2] for i in self.ao_ranges]
         self.state = 1
         self.suspend_to = 0.0
-        self.logger.debug(f'{self.pre} has been initialized')
+        self.logger.debug('%s has been initialized', self.pre)
         return True
 
 
@@ -21,6 +21,9 @@ from tango import DevState, AttrDataFormat
 from tango.server import attribute, command
 
 from Adam import Adam, ADAM_DEVICES, FakeAdam
+from ChangePublisher import ChangePublisher
+from DevicePoller import DevicePoller
+from StartupOrchestrator import StartupOrchestrator
 from TangoServerPrototype import TangoServerPrototype
 
 ORGANIZATION_NAME = 'BINP'
@@ -28,6 +31,10 @@ APPLICATION_NAME = 'Adam I/O modules Tango Server'
 APPLICATION_NAME_SHORT = 'AdamServer'
 APPLICATION_VERSION = '2.2'
 
+DEFAULT_AI_VALID_TIME = 0.3
+# acquisition loop is off unless event_period property is set, it adds bus traffic
+DEFAULT_EVENT_PERIOD = 0.0
+
 
 # db = tango.Database('192.168.1.41', '10000')
 # dn = 'binp/nbi/adam4055'
@@ -59,6 +66,12 @@ class AdamServer(TangoServerPrototype):
                         unit="", format="%s",
                         doc="Adam address")
 
+    mean_latency = attribute(label="Mean latency", dtype=float,
+                             display_level=DispLevel.EXPERT,
+                             access=AttrWriteType.READ,
+                             unit="ms", format="%6.1f",
+                             doc="Mean serial transaction time, see read_metrics command for details")
+
     device_type = attribute(label="Adam Type", dtype=str,
                             display_level=DispLevel.OPERATOR,
                             access=AttrWriteType.READ,
@@ -76,6 +89,8 @@ class AdamServer(TangoServerPrototype):
         self.lock = Lock()
         self.init_io = True
         self.init_po = True
+        # re-initialized device waits for creation of IO attributes in Tango thread
+        self.io_pending = False
         self.dynamic_attributes = {}
         #
         name = self.config.get('name', '')
@@ -84,18 +99,52 @@ class AdamServer(TangoServerPrototype):
             ADAM_DEVICES.update({name: description})
             self.log_debug(f'New device type {name}: {description} registered')
         self.show_disabled_channels = bool(self.config.get('show_disabled_channels', 1))
+        # all analog inputs are read by one #AA command into timestamped snapshot
+        self.ai_valid_time = self.config.get('ai_valid_time', DEFAULT_AI_VALID_TIME)
+        self.ai_values = []
+        self.ai_time = 0.0
+        # ai_values are from the last successful read, False after failed one
+        self.ai_valid = False
+        # acquisition loop pushes change/archive events for inputs, event_period <= 0 (default) disables it
+        self.publisher = ChangePublisher(self, self.config.get('abs_change', 0.0),
+                                         self.config.get('rel_change', 0.0), logger=self.logger)
+        try:
+            self.publisher.deadbands.update(json.loads(self.config.get('deadbands', '{}')))
+        except KeyboardInterrupt:
+            raise
+        except:
+            # wrong property value should not prevent device creation
+            self.log_exception('Wrong deadbands property, ignored')
+        self.event_period = self.config.get('event_period', DEFAULT_EVENT_PERIOD)
+        self.poller = None
+        if self.event_period > 0.0:
+            self.poller = DevicePoller(self.acquire, self.event_period, name=f'{self.get_name()} acquisition',
+                                       logger=self.logger, callback=self.publish_events)
         # create adam device
         port = self.config.get('port', 'COM3')
         addr = self.config.get('addr', 6)
         kwargs = {'baudrate': self.config.get('baudrate', 38400),
                   'logger': self.logger,
                   'read_retries': self.config.get('read_retries', 2),
-                  'suspend_delay': self.config.get('suspend_delay', 10.0)}
+                  'suspend_delay': self.config.get('suspend_delay', 10.0),
+                  # PortBroker address to share the port with other server processes, '' - direct access
+                  'broker': self.config.get('broker', ''),
+                  # shared connection with keep-alive and reconnect backoff for host:port ports
+                  'tcp_pool': self.config.get('tcp_pool', False),
+                  # re-probe suspended device by background DeviceRecovery worker instead of inline in requests
+                  'background_recovery': self.config.get('background_recovery', False),
+                  # skip probing of ranges and masks at restart using identity saved on disk
+                  'identity_cache': self.config.get('identity_cache', False)}
+        # device probing is done by StartupOrchestrator, in parallel for different ports
+        kwargs['defer_init'] = True
         emulate = self.config.get('emulate', 0)
         if emulate:
             self.adam = FakeAdam(port, addr, **kwargs)
         else:
             self.adam = Adam(port, addr, **kwargs)
+        StartupOrchestrator.submit(self.get_name(), port, self.adam.init, callback=self.complete_init)
+
+    def complete_init(self, result=None):
         self.pre = f'{self.get_name()} {self.adam.pre}'
         # execute init sequence
         init_command = self.config.get('init_command', '')
@@ -110,10 +159,8 @@ class AdamServer(TangoServerPrototype):
         if self.adam.ready:
             # if device was initiated before
             if hasattr(self, 'deleted') and self.deleted:
-                self.add_io()
-                self.restore_polling()
-                self.init_io = False
-                self.init_po = False
+                # executed in StartupOrchestrator thread, attributes are added by complete_io()
+                self.io_pending = True
                 self.deleted = False
             # change state to running
             msg = 'Created successfully'
@@ -125,6 +172,8 @@ class AdamServer(TangoServerPrototype):
             self.log_error(msg)
 
     def delete_device(self):
+        if self.poller is not None:
+            self.poller.stop(2.0 * self.event_period + self.adam.read_timeout)
         self.save_polling_state()
         # self.stop_polling()
         self.remove_io()
@@ -135,8 +184,20 @@ class AdamServer(TangoServerPrototype):
         self.deleted = True
         super().delete_device()
 
+    def complete_io(self):
+        # executed in Tango thread: IO attributes of re-initialized device after its probing is completed
+        if not self.io_pending or not self.adam.ready:
+            return False
+        self.io_pending = False
+        self.add_io()
+        self.restore_polling()
+        self.init_io = False
+        self.init_po = False
+        return True
+
 # ******** attribute r/w procedures ***********
     def read_port(self):
+        self.complete_io()
         if self.adam.ready:
             self.set_running()
         else:
@@ -144,6 +205,7 @@ class AdamServer(TangoServerPrototype):
         return self.adam.port
 
     def read_address(self):
+        self.complete_io()
         if self.adam.ready:
             self.set_running()
         else:
@@ -151,6 +213,7 @@ class AdamServer(TangoServerPrototype):
         return str(self.adam.addr)
 
     def read_device_type(self):
+        self.complete_io()
         if self.adam.ready:
             self.set_running()
             return self.adam.id
@@ -182,6 +245,8 @@ class AdamServer(TangoServerPrototype):
                 self.log_error(msg)
                 attr.set_quality(tango.AttrQuality.ATTR_INVALID)
                 return
+            if self.poller is not None:
+                self.poller.refresh()
             if result:
                 attr.set_quality(tango.AttrQuality.ATTR_VALID)
             else:
@@ -199,7 +264,9 @@ class AdamServer(TangoServerPrototype):
         chan = int(attr_name[-2:])
         ad = attr_name[:2]
         if ad == 'ai':
-            val = self.adam.read_ai(chan)
+            # no per channel reads when snapshot fails, the bus is not answering anyway
+            values = self.read_ai_snapshot()
+            val = values[chan] if values else None
         elif ad == 'di':
             val = self.adam.read_di(chan)
         elif ad == 'do':
@@ -216,7 +283,82 @@ class AdamServer(TangoServerPrototype):
         self.log_error(msg)
         return None
 
+    def read_ai_snapshot(self):
+        # returns all analog input values not older than ai_valid_time or None.
+        # Failed read keeps the last values marked invalid, next #AA is sent not earlier than ai_valid_time later
+        if time.time() - self.ai_time < self.ai_valid_time:
+            return self.ai_values if self.ai_valid else None
+        values = self.adam.read_ai()
+        self.ai_time = time.time()
+        if values and len(values) == self.adam.ai_n:
+            self.ai_values = values
+            self.ai_valid = True
+            return values
+        self.ai_valid = False
+        self.log_debug('Error reading AI snapshot %s', values)
+        return None
+
+    def read_ai_all(self, attr: tango.Attribute):
+        with self.lock:
+            values = self.read_ai_snapshot()
+            if values:
+                attr.set_value(values)
+                attr.set_quality(tango.AttrQuality.ATTR_VALID)
+                self.set_running()
+                return values
+            self.set_fault()
+            if self.ai_values:
+                # last known values with invalid quality
+                attr.set_value(self.ai_values)
+                attr.set_quality(tango.AttrQuality.ATTR_INVALID)
+                return self.ai_values
+            return self.set_error_attribute_value(attr)
+
+    def acquire(self):
+        # executed in acquisition thread only, returns {attr_name: value or None}
+        values = {}
+        with self.lock:
+            if not self.adam.ready:
+                return {name: None for name in self.publisher.deadbands}
+            if self.adam.ai_n > 0:
+                ai = self.read_ai_snapshot()
+                values['ai'] = ai
+                for k in range(self.adam.ai_n):
+                    values['ai%02d' % k] = ai[k] if ai else None
+            if self.adam.di_n > 0 or self.adam.do_n > 0:
+                do, di = self.adam.read_di_do()
+                for k in range(self.adam.di_n):
+                    values['di%02d' % k] = di[k] if di else None
+                for k in range(self.adam.do_n):
+                    values['do%02d' % k] = do[k] if do else None
+        return values
+
+    def publish_events(self, snapshot):
+        if snapshot.values is not None:
+            self.publisher.publish_all(snapshot.values)
+
+    def read_mean_latency(self):
+        return self.adam.metrics.mean_latency()
+
 # ******** commands ***********
+    @command(dtype_in=None, dtype_out=str,
+             doc_out='JSON transaction metrics: latency histograms per command, retries, timeouts, ADR switches, suspends')
+    def read_metrics(self):
+        return self.adam.metrics.as_json()
+
+    @command(dtype_in=None, dtype_out=bool, doc_out='Create IO attributes after re-initialization, False if nothing to do')
+    def add_io_attributes(self):
+        return self.complete_io()
+
+    @command(dtype_in=None, dtype_out=None, doc_out='Reset transaction metrics')
+    def reset_metrics(self):
+        self.adam.metrics.reset()
+
+    @command(dtype_in=None, dtype_out=str,
+             doc_out='JSON learned read timeouts: latency estimates and timeout per command class')
+    def read_timeouts(self):
+        return self.adam.timeouts.as_json()
+
     @command(dtype_in=str, doc_in='Directly send command to the Adam',
              dtype_out=str, doc_out='Response from Adam without final <CR>')
     def send_adam_command(self, cmd):
@@ -297,6 +439,25 @@ class AdamServer(TangoServerPrototype):
                             self.log_exception('Exception adding AI %s' % attr_name)
                     msg = '%d of %d analog inputs initialized' % (nai, self.adam.ai_n)
                     self.log_info(msg)
+                    # all analog inputs as spectrum
+                    try:
+                        attr_name = 'ai'
+                        attr = attribute(name=attr_name, dtype=float,
+                                         dformat=AttrDataFormat.SPECTRUM,
+                                         access=AttrWriteType.READ,
+                                         max_dim_x=self.adam.ai_n, max_dim_y=0,
+                                         fget=self.read_ai_all,
+                                         label=attr_name,
+                                         doc='All analog inputs',
+                                         unit='',
+                                         display_unit=1.0,
+                                         format='%6.3f')
+                        self.add_attribute(attr)
+                        self.dynamic_attributes[attr_name] = attr
+                    except KeyboardInterrupt:
+                        raise
+                    except:
+                        self.log_exception('Exception adding AI spectrum attribute')
                 # ao
                 nao = 0
                 if self.adam.ao_n > 0:
@@ -389,6 +550,11 @@ class AdamServer(TangoServerPrototype):
             except:
                 self.log_exception('Error adding IO channels')
                 self.set_state(DevState.FAULT, msg)
+            for attr_name in self.dynamic_attributes:
+                if not attr_name.startswith('ao'):
+                    self.publisher.configure(attr_name)
+            if self.poller is not None and not self.poller.is_alive() and not self.poller.stopped.is_set():
+                self.poller.start()
             self.init_io = False
             self.init_po = True
             # self.restore_polling()
@@ -398,6 +564,7 @@ class AdamServer(TangoServerPrototype):
         with self.lock:
             try:
                 for attr_name in self.dynamic_attributes:
+                    self.publisher.remove(attr_name)
                     self.remove_attribute(attr_name)
                     self.log_debug(' Attribute %s removed' % attr_name)
                 self.dynamic_attributes = {}
@@ -430,6 +597,7 @@ class AdamServer(TangoServerPrototype):
 
 def post_init_callback():
     # called once at server initiation
+    StartupOrchestrator.wait_all()
     for dev in AdamServer.devices:
         v = AdamServer.devices[dev]
         if v.init_io:
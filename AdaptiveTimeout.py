@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+from threading import Lock
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'Read timeouts learned from observed device latency'
+APPLICATION_NAME_SHORT = 'AdaptiveTimeout'
+APPLICATION_VERSION = '1.0'
+
+
+class LatencyEstimator:
+    # smoothed latency and its mean deviation, as TCP retransmission timer (RFC 6298)
+    ALPHA = 0.125
+    BETA = 0.25
+
+    def __init__(self):
+        self.srtt = 0.0
+        self.rttvar = 0.0
+        self.n = 0
+
+    def update(self, rtt):
+        if self.n <= 0:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self.n += 1
+
+    def as_dict(self):
+        return {'n': self.n, 'srtt_ms': self.srtt * 1000.0, 'rttvar_ms': self.rttvar * 1000.0}
+
+
+class AdaptiveTimeout:
+    # Per device (port:address) read timeout derived from latency of successful transactions
+    # of the same command class: srtt + max(K * rttvar, MARGIN * srtt), limited by floor and ceiling.
+    # Until the class has MIN_SAMPLES samples the device wide estimate is used, before any sample - ceiling.
+    # Every timeout doubles the next timeouts (up to MAX_BACKOFF times), success resets the backoff.
+    _registry = {}
+    _lock = Lock()
+    K = 4.0
+    MARGIN = 0.5
+    MIN_SAMPLES = 3
+    MAX_BACKOFF = 4
+    MAX_CLASSES = 64
+    FLOOR = 0.05
+
+    def __init__(self, name, floor=FLOOR, ceiling=1.0, enabled=True):
+        self.name = name
+        self.floor = floor
+        self.ceiling = ceiling
+        self.enabled = enabled
+        self.reset()
+
+    @staticmethod
+    def get(port, addr, floor=FLOOR, ceiling=1.0, enabled=True):
+        # the same object for the same port:address, learned values survive device re-creation
+        name = f'{str(port).strip()}:{addr}'
+        with AdaptiveTimeout._lock:
+            if name not in AdaptiveTimeout._registry:
+                AdaptiveTimeout._registry[name] = AdaptiveTimeout(name, floor, ceiling, enabled)
+            t = AdaptiveTimeout._registry[name]
+            t.floor = floor
+            t.ceiling = ceiling
+            t.enabled = enabled
+            return t
+
+    def reset(self):
+        self.device = LatencyEstimator()
+        self.classes = {}
+        self.backoff = 1
+        self.expirations = 0
+
+    def timeout(self, cls=None):
+        if not self.enabled:
+            return self.ceiling
+        e = self.classes.get(cls)
+        if e is None or e.n < self.MIN_SAMPLES:
+            e = self.device
+        if e.n <= 0:
+            return self.ceiling
+        t = e.srtt + max(self.K * e.rttvar, self.MARGIN * e.srtt)
+        return min(self.ceiling, max(self.floor, t) * self.backoff)
+
+    def sample(self, cls, rtt):
+        # rtt in seconds of a successful transaction
+        if cls not in self.classes:
+            if len(self.classes) >= self.MAX_CLASSES:
+                cls = 'other'
+            self.classes.setdefault(cls, LatencyEstimator())
+        self.classes[cls].update(rtt)
+        self.device.update(rtt)
+        self.backoff = 1
+
+    def expired(self, cls=None):
+        self.expirations += 1
+        self.backoff = min(2 * self.backoff, self.MAX_BACKOFF)
+
+    def as_dict(self):
+        return {'device': self.name,
+                'enabled': self.enabled,
+                'floor_ms': self.floor * 1000.0,
+                'ceiling_ms': self.ceiling * 1000.0,
+                'backoff': self.backoff,
+                'expirations': self.expirations,
+                'timeout_ms': self.timeout() * 1000.0,
+                'latency': self.device.as_dict(),
+                'classes': {c: dict(e.as_dict(), timeout_ms=self.timeout(c) * 1000.0)
+                            for c, e in self.classes.items()}}
+
+    def as_json(self):
+        return json.dumps(self.as_dict())
+
+
+if __name__ == "__main__":
+    import random
+
+    t = AdaptiveTimeout.get('COM1', 6)
+    print('initial %6.1f ms' % (t.timeout('DVC?') * 1000.0))
+    for i in range(200):
+        t.sample('DVC?', random.gauss(0.060, 0.005))
+        t.sample('OUT?', random.gauss(0.012, 0.002))
+    print('DVC? %6.1f ms, OUT? %6.1f ms, ADR (device wide) %6.1f ms' %
+          (t.timeout('DVC?') * 1000.0, t.timeout('OUT?') * 1000.0, t.timeout('ADR') * 1000.0))
+    for i in range(3):
+        t.expired('DVC?')
+        print('after %d timeouts DVC? %6.1f ms' % (i + 1, t.timeout('DVC?') * 1000.0))
+    print(t.as_json())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
+if '../IT6900' not in sys.path: sys.path.append('../IT6900')
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from Adam import Adam
+from Lauda import Lauda
+from LaudaSmall import LaudaSmall
+from TDKLambda import TDKLambda
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'TDK Lambda Genesis series PS asyncio Python API'
+APPLICATION_NAME_SHORT = 'AsyncTDKLambda'
+APPLICATION_VERSION = '1.0'
+
+
+class AsyncTDKLambda:
+    # Asyncio front end for TDKLambda family devices.
+    # Every port has one worker thread, all devices at this port share it,
+    # so bus transactions are serialized per port and run in parallel for different ports,
+    # while the event loop thread never blocks on serial I/O.
+    DEVICE_CLASS = TDKLambda
+    _executors = {}
+    _lock = Lock()
+
+    def __init__(self, port, addr, **kwargs):
+        self.port = port.strip()
+        self.addr = addr
+        self.kwargs = kwargs
+        self.device = None
+
+    @classmethod
+    def executor(cls, port):
+        with AsyncTDKLambda._lock:
+            if port not in AsyncTDKLambda._executors:
+                AsyncTDKLambda._executors[port] = ThreadPoolExecutor(max_workers=1,
+                                                                     thread_name_prefix=f'Port {port}')
+            return AsyncTDKLambda._executors[port]
+
+    @classmethod
+    def shutdown(cls, wait=True):
+        with AsyncTDKLambda._lock:
+            for ex in AsyncTDKLambda._executors.values():
+                ex.shutdown(wait=wait)
+            AsyncTDKLambda._executors.clear()
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor(self.port), functools.partial(func, *args, **kwargs))
+
+    async def init(self):
+        # device creation probes the bus, so it is done at port thread too
+        if self.device is None:
+            self.device = await self.run(self.DEVICE_CLASS, self.port, self.addr, **self.kwargs)
+            return self.device.state > 0
+        return await self.run(self.device.init)
+
+    async def ready(self):
+        return await self.run(lambda: self.device.ready)
+
+    def __getattr__(self, name):
+        # any driver method is available as a coroutine: await dev.read_all()
+        device = self.__dict__.get('device')
+        if device is None:
+            raise AttributeError(f'{name}: device at {self.port}:{self.addr} is not initialized')
+        attr = getattr(device, name)
+        if not callable(attr):
+            return attr
+
+        async def method(*args, **kwargs):
+            return await self.run(attr, *args, **kwargs)
+
+        method.__name__ = name
+        return method
+
+    async def close(self):
+        if self.device is not None:
+            await self.run(self.device.__del__)
+
+
+class AsyncAdam(AsyncTDKLambda):
+    DEVICE_CLASS = Adam
+
+
+class AsyncLauda(AsyncTDKLambda):
+    DEVICE_CLASS = Lauda
+
+    def __init__(self, port, addr=5, **kwargs):
+        super().__init__(port, addr, **kwargs)
+
+
+class AsyncLaudaSmall(AsyncTDKLambda):
+    DEVICE_CLASS = LaudaSmall
+
+    def __init__(self, port, addr=None, **kwargs):
+        super().__init__(port, addr, **kwargs)
+
+
+async def main():
+    devices = [AsyncTDKLambda(f'FAKECOM{p}', a) for p in range(1, 5) for a in range(1, 4)]
+    await asyncio.gather(*[d.init() for d in devices])
+    await asyncio.gather(*[d.write_voltage(1.5) for d in devices])
+    t_0 = time.time()
+    values = await asyncio.gather(*[d.read_all() for d in devices])
+    dt = int((time.time() - t_0) * 1000.0)  # ms
+    for d, v in zip(devices, values):
+        print(d.port, d.addr, 'read_all ->', v)
+    print(len(devices), 'devices at 4 ports read in %4d ms' % dt)
+    for d in devices:
+        await d.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+    AsyncTDKLambda.shutdown()
+    print('Finished')
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
+if '../IT6900' not in sys.path: sys.path.append('../IT6900')
+
+import heapq
+import itertools
+import time
+from concurrent.futures import Future
+from threading import Condition, Lock, Thread, current_thread
+
+from config_logger import config_logger
+from log_exception import log_exception
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'Per port bus request scheduler for TDKLambda family devices'
+APPLICATION_NAME_SHORT = 'BusScheduler'
+APPLICATION_VERSION = '1.0'
+
+WRITE_PRIORITY = 0
+READ_PRIORITY = 1
+
+
+class BusScheduler:
+    # One scheduler per COM port owns the bus and executes queued requests of all devices.
+    # Order: priority (writes before polling), then requests for the current bus address
+    # (no ADR switch), then FIFO. MAX_BATCH limits requests served at one address in a row.
+    _schedulers = {}
+    _lock = Lock()
+    MAX_BATCH = 16
+
+    def __init__(self, com, logger=None):
+        self.com = com
+        self.logger = logger if logger is not None else config_logger()
+        self.queue = []
+        self.counter = itertools.count()
+        self.condition = Condition()
+        self.batch = 0
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True, name=f'BusScheduler {getattr(com, "port", "")}')
+        self.thread.start()
+
+    @staticmethod
+    def for_port(com, logger=None):
+        with BusScheduler._lock:
+            key = id(com)
+            if key not in BusScheduler._schedulers:
+                BusScheduler._schedulers[key] = BusScheduler(com, logger)
+            return BusScheduler._schedulers[key]
+
+    @staticmethod
+    def stop_all():
+        with BusScheduler._lock:
+            for s in BusScheduler._schedulers.values():
+                s.stop()
+            BusScheduler._schedulers.clear()
+
+    def submit(self, device, func, *args, priority=None, **kwargs) -> Future:
+        # func is a bound method of device, result is returned via Future
+        if priority is None:
+            name = getattr(func, '__name__', '')
+            priority = WRITE_PRIORITY if name.startswith('write') else READ_PRIORITY
+        future = Future()
+        with self.condition:
+            heapq.heappush(self.queue, (priority, next(self.counter), device.addr, func, args, kwargs, future))
+            self.condition.notify()
+        return future
+
+    def in_worker(self):
+        # requests executed by the scheduler thread run directly
+        return current_thread() is self.thread
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(1.0)
+
+    def _next_request(self):
+        # called with condition acquired and non-empty queue
+        top = self.queue[0]
+        current = getattr(self.com, 'current_addr', -1)
+        if top[2] != current and self.batch < self.MAX_BATCH:
+            # look for the request of the same priority at the current address
+            best = None
+            for i, r in enumerate(self.queue):
+                if r[0] == top[0] and r[2] == current and (best is None or r[1] < self.queue[best][1]):
+                    best = i
+            if best is not None:
+                r = self.queue[best]
+                self.queue[best] = self.queue[-1]
+                self.queue.pop()
+                heapq.heapify(self.queue)
+                self.batch += 1
+                return r
+        r = heapq.heappop(self.queue)
+        self.batch = self.batch + 1 if r[2] == current else 0
+        return r
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    for r in self.queue:
+                        r[6].cancel()
+                    self.queue.clear()
+                    return
+                priority, n, addr, func, args, kwargs, future = self._next_request()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except KeyboardInterrupt:
+                raise
+            except Exception as ex:
+                log_exception(self.logger, f'BusScheduler request {func} exception')
+                future.set_exception(ex)
+
+
+if __name__ == "__main__":
+    from threading import Event
+    from TDKLambda import TDKLambda
+
+    class CountingTDKLambda(TDKLambda):
+        adr_count = 0
+        transactions = 0
+
+        def _set_addr(self):
+            CountingTDKLambda.adr_count += 1
+            return super()._set_addr()
+
+        def _send_command(self, cmd, *args, **kwargs):
+            CountingTDKLambda.transactions += 1
+            return super()._send_command(cmd, *args, **kwargs)
+
+    def run(devices, n):
+        # pollers of all devices but the last one, as with separate Tango servers, write to the last one
+        stop = Event()
+
+        def poll(d):
+            while not stop.is_set():
+                d.read_all()
+
+        threads = [Thread(target=poll, args=(d,)) for d in devices[:-1]]
+        for t in threads:
+            t.start()
+        latency = []
+        for i in range(n):
+            time.sleep(0.02)
+            t_1 = time.perf_counter()
+            devices[-1].write_voltage(float(i))
+            latency.append(time.perf_counter() - t_1)
+        stop.set()
+        for t in threads:
+            t.join()
+        return latency
+
+    n = 20
+    for name, port, scheduled in (('lock', 'FAKECOM8', False), ('scheduler', 'FAKECOM18', True)):
+        devices = [CountingTDKLambda(port, a, bus_scheduler=scheduled, identity_cache=False) for a in range(1, 9)]
+        CountingTDKLambda.adr_count = 0
+        CountingTDKLambda.transactions = 0
+        t_0 = time.time()
+        latency = run(devices, n)
+        dt = time.time() - t_0
+        print('%-10s %6.1f transactions/s, write latency mean %6.1f ms max %6.1f ms, %d ADR' %
+              (name, CountingTDKLambda.transactions / dt, sum(latency) / n * 1000.0, max(latency) * 1000.0,
+               CountingTDKLambda.adr_count))
+    BusScheduler.stop_all()
+    print('Finished')
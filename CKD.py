@@ -62,7 +62,7 @@ class CKD(ModbusDevice):
                     return v[0]
                 else:
                     time.sleep(0.01)
-                    self.logger.debug(f'Retry {3 - retries}')
+                    self.logger.debug('Retry %s', 3 - retries)
                     retries -= 1
                     if not retries:
                         return None
@@ -132,9 +132,10 @@ class CKD(ModbusDevice):
                 msg += int.to_bytes(length // 2, 2, byteorder="big")
                 msg += int.to_bytes(length, 1, byteorder='big')
             msg += out
-            if not self.write(msg):
-                return 0
-            if not self.read():
+            t0 = time.perf_counter()
+            result = self.write(msg) and self.read()
+            self.metrics.record(f'FC{self.command}', time.perf_counter() - t0, result)
+            if not result:
                 return 0
             data_out = int.from_bytes(self.response[4:6], byteorder='big')
             if data[0] == data_out:
@@ -151,9 +152,10 @@ class CKD(ModbusDevice):
             msg += int.to_bytes(start, 2, byteorder='big')
             msg += int.to_bytes(length, 2, byteorder='big')
             data = []
-            if not self.write(msg):
-                return data
-            if not self.read():
+            t0 = time.perf_counter()
+            result = self.write(msg) and self.read()
+            self.metrics.record(f'FC{self.command}', time.perf_counter() - t0, result)
+            if not result:
                 return data
             data_length = self.response[2]
             for i in range(data_length):
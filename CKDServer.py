@@ -8,7 +8,9 @@ import time
 
 # from numpy.array_api import int64
 
+from AdaptiveTimeout import AdaptiveTimeout
 from CKD import CKD
+from DeviceRecovery import DeviceRecovery
 
 util_path = os.path.realpath('../TangoUtils')
 if util_path not in sys.path:
@@ -155,6 +157,15 @@ class CKDServer(TangoServerPrototype):
         addr = self.config.get('addr', DEFAULT_ADDRESS)
         kwargs['logger'] = self.logger
         kwargs['read_timeout'] = self.config.get('read_timeout', DEFAULT_READ_TIMEOUT)
+        # adaptive read timeout between min_timeout and read_timeout
+        kwargs['adaptive_timeout'] = self.config.get('adaptive_timeout', False)
+        kwargs['min_timeout'] = self.config.get('min_timeout', AdaptiveTimeout.FLOOR)
+        # PortBroker address to share the port with other server processes, '' - direct access
+        kwargs['broker'] = self.config.get('broker', '')
+        # shared connection with keep-alive and reconnect backoff for host:port ports
+        kwargs['tcp_pool'] = self.config.get('tcp_pool', False)
+        # re-probe suspended device by background DeviceRecovery worker instead of inline in requests
+        kwargs['background_recovery'] = self.config.get('background_recovery', False)
         # create CKD device
         self.ckd = CKD(port, **kwargs)
         # check if device OK
@@ -182,6 +193,7 @@ class CKDServer(TangoServerPrototype):
 
     def delete_device(self):
         # self.tmr.__del__()
+        DeviceRecovery.cancel(self.ckd)
         super().delete_device()
         msg = 'Device has been deleted'
         self.log_info(msg)
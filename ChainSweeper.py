@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
+if '../IT6900' not in sys.path: sys.path.append('../IT6900')
+
+import time
+from threading import Event, Lock
+
+from DevicePoller import DevicePoller, Snapshot
+from log_exception import log_exception
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'Chain level DVC? sweep for TDKLambda devices at one port'
+APPLICATION_NAME_SHORT = 'ChainSweeper'
+APPLICATION_VERSION = '1.0'
+
+
+class ChainSweeper(DevicePoller):
+    # One poller thread per port visits every subscribed address once per cycle in address order:
+    # ADR n, DVC?, OUT? - 3 bus transactions per device and sweep (ADR is skipped if the bus is already at n).
+    # With output_every > 1 OUT? is read for every address once per output_every sweeps (addresses are
+    # spread over the sweeps) and in the next sweep after refresh() of its view. Output may be switched off
+    # without our writes (OVP, foldback, front panel, other clients), then its state is stale up to
+    # output_every sweeps. Per address snapshots are published in self.snapshots {addr: Snapshot}.
+    _sweepers = {}
+    _lock = Lock()
+
+    def __init__(self, port, period=0.5, logger=None, output_every=1):
+        super().__init__(self.sweep, period, name=f'ChainSweeper {port}', logger=logger, callback=self.dispatch)
+        self.port = port
+        self.views = []
+        self.views_lock = Lock()
+        # {addr: Snapshot((dvc, output), time, valid)}, replaced by single assignment under snapshots_lock
+        self.snapshots = {}
+        self.snapshots_lock = Lock()
+        self.sweeps = 0
+        self.output_every = max(1, int(output_every))
+
+    @staticmethod
+    def get(port, period=0.5, logger=None, output_every=1):
+        # the same sweeper for all devices at the port, the shortest requested period
+        # and the most frequent output reading win
+        port = str(port).strip()
+        with ChainSweeper._lock:
+            sweeper = ChainSweeper._sweepers.get(port)
+            if sweeper is None or sweeper.stopped.is_set():
+                sweeper = ChainSweeper(port, period, logger, output_every)
+                ChainSweeper._sweepers[port] = sweeper
+            sweeper.period = min(sweeper.period, period)
+            sweeper.output_every = min(sweeper.output_every, max(1, int(output_every)))
+            return sweeper
+
+    def subscribe(self, device, validate=None, callback=None):
+        # returns DevicePoller compatible view of the device snapshot
+        view = ChainView(self, device, validate, callback)
+        with self.views_lock:
+            self.views.append(view)
+            self.views.sort(key=lambda v: v.device.addr)
+        return view
+
+    def unsubscribe(self, view, timeout=None):
+        with self.views_lock:
+            if view in self.views:
+                self.views.remove(view)
+            empty = not self.views
+        self.publish(view.device.addr, None)
+        if empty:
+            with ChainSweeper._lock:
+                if ChainSweeper._sweepers.get(self.port) is self:
+                    ChainSweeper._sweepers.pop(self.port)
+            self.stop(timeout)
+
+    def sweep(self):
+        # executed in sweeper thread only
+        with self.views_lock:
+            views = list(self.views)
+        for view in views:
+            output = view.output_due or (self.sweeps + view.device.addr) % self.output_every == 0
+            self.publish(view.device.addr, view.read(output))
+        self.sweeps += 1
+        return self.snapshots
+
+    def publish(self, addr, snapshot):
+        # copy on write, readers take self.snapshots without lock; None removes the address
+        with self.snapshots_lock:
+            snapshots = dict(self.snapshots)
+            if snapshot is None:
+                snapshots.pop(addr, None)
+            else:
+                snapshots[addr] = snapshot
+            self.snapshots = snapshots
+
+    def dispatch(self, snapshot):
+        with self.views_lock:
+            views = list(self.views)
+        for view in views:
+            if view.callback is None:
+                continue
+            try:
+                view.callback(view.snapshot)
+            except KeyboardInterrupt:
+                raise
+            except:
+                log_exception(self.logger, f'{self.name} callback error for address {view.device.addr}')
+
+    def start(self):
+        with ChainSweeper._lock:
+            if not self.is_alive() and not self.stopped.is_set():
+                super().start()
+
+
+class ChainView:
+    # DevicePoller interface for one device served by ChainSweeper
+    def __init__(self, sweeper, device, validate=None, callback=None):
+        self.sweeper = sweeper
+        self.device = device
+        self.validate = validate
+        self.callback = callback
+        self.stopped = Event()
+        # read OUT? at the next sweep
+        self.output_due = True
+
+    @property
+    def snapshot(self):
+        return self.sweeper.snapshots.get(self.device.addr, Snapshot(None, 0.0, False))
+
+    def read(self, output=True):
+        # ADR + DVC? (+ OUT?) for this device only, otherwise output state of the last valid snapshot
+        start = time.time()
+        try:
+            last = self.snapshot
+            if output or not last.valid or last.values is None:
+                self.output_due = False
+                values = self.device.read_status()
+            else:
+                values = (self.device.read_all(), last.values[1])
+            valid = values is not None if self.validate is None else self.validate(values)
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.sweeper.logger, f'{self.sweeper.name} address {self.device.addr} polling error')
+            values = self.snapshot.values
+            valid = False
+        return Snapshot(values, time.time(), valid, start)
+
+    def poll(self):
+        # out of cycle reading of this device, e.g. at device initialization
+        snapshot = self.read()
+        self.sweeper.publish(self.device.addr, snapshot)
+        if self.callback is not None:
+            try:
+                self.callback(snapshot)
+            except KeyboardInterrupt:
+                raise
+            except:
+                log_exception(self.sweeper.logger, f'{self.sweeper.name} callback error')
+        return snapshot
+
+    def start(self):
+        self.sweeper.start()
+
+    def refresh(self):
+        # e.g. after write, output state may be changed
+        self.output_due = True
+        self.sweeper.refresh()
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        self.sweeper.unsubscribe(self, timeout)
+
+    def age(self):
+        return time.time() - self.snapshot.time
+
+
+if __name__ == "__main__":
+    from threading import Thread
+    from TDKLambda import TDKLambda
+
+    class CountingTDKLambda(TDKLambda):
+        transactions = 0
+
+        def _send_command(self, cmd, *args, **kwargs):
+            CountingTDKLambda.transactions += 1
+            return super()._send_command(cmd, *args, **kwargs)
+
+    devices = [CountingTDKLambda('FAKECOM9', a, identity_cache=False) for a in range(1, 11)]
+    sweeper = ChainSweeper.get('FAKECOM9', 0.0)
+    views = [sweeper.subscribe(d) for d in devices]
+    # first sweep reads output state of all devices
+    sweeper.poll()
+    n = 20
+    for k in (1, 10):
+        sweeper.output_every = k
+        CountingTDKLambda.transactions = 0
+        t_0 = time.time()
+        for i in range(n):
+            sweeper.poll()
+        dt = time.time() - t_0
+        print('sweep, OUT? every %2d: %d devices %5.1f transactions per refresh %6.1f ms per refresh' %
+              (k, len(devices), CountingTDKLambda.transactions / n, dt / n * 1000.0))
+    # independent poller threads, one per device, as with separate servers
+    CountingTDKLambda.transactions = 0
+    threads = [Thread(target=lambda d=d: [d.read_status() for i in range(n)]) for d in devices]
+    t_0 = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    dt = time.time() - t_0
+    print('per device: %d devices %5.1f transactions per refresh %6.1f ms per refresh' %
+          (len(devices), CountingTDKLambda.transactions / n, dt / n * 1000.0))
+    # output switched by write is seen at the next sweep
+    devices[3].write_output(True)
+    views[3].refresh()
+    sweeper.poll()
+    print(views[3].snapshot)
+    for v in views:
+        v.stop()
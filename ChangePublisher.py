@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
+
+import math
+import time
+
+from tango import AttrQuality
+
+from log_exception import log_exception
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'Tango change/archive events with deadbands'
+APPLICATION_NAME_SHORT = 'ChangePublisher'
+APPLICATION_VERSION = '1.0'
+
+
+class ChangePublisher:
+    # Pushes change and archive events for attributes of a tango device when value moves
+    # past absolute or relative deadband, quality changes or value becomes (in)valid.
+    # Events are pushed by the server (detect=False), clients subscribe instead of polling.
+    def __init__(self, device, abs_change=0.0, rel_change=0.0, logger=None):
+        self.device = device
+        self.abs_change = abs_change
+        self.rel_change = rel_change
+        self.logger = logger if logger is not None else device.logger
+        # {attr_name: [abs_change, rel_change]}
+        self.deadbands = {}
+        # {attr_name: (value, quality)} of the last pushed event
+        self.last = {}
+        self.pushed = 0
+        self.skipped = 0
+
+    def configure(self, name, abs_change=None, rel_change=None):
+        if abs_change is None:
+            abs_change = self.deadbands.get(name, [self.abs_change, self.rel_change])[0]
+        if rel_change is None:
+            rel_change = self.deadbands.get(name, [self.abs_change, self.rel_change])[1]
+        self.deadbands[name] = [abs_change, rel_change]
+        try:
+            self.device.set_change_event(name, True, False)
+            self.device.set_archive_event(name, True, False)
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'Can not enable events for {name}')
+
+    def remove(self, name):
+        self.deadbands.pop(name, None)
+        self.last.pop(name, None)
+
+    def changed(self, name, old, new):
+        if isinstance(new, (list, tuple)):
+            if not isinstance(old, (list, tuple)) or len(old) != len(new):
+                return True
+            return any(self.changed(name, o, n) for o, n in zip(old, new))
+        if isinstance(new, bool) or not isinstance(new, (int, float)) or isinstance(old, bool):
+            return old != new
+        if math.isnan(new) or math.isnan(old):
+            return math.isnan(new) != math.isnan(old)
+        abs_change, rel_change = self.deadbands.get(name, [self.abs_change, self.rel_change])
+        delta = abs(new - old)
+        if abs_change <= 0.0 and rel_change <= 0.0:
+            return delta > 0.0
+        if 0.0 < abs_change <= delta:
+            return True
+        if rel_change > 0.0 and delta >= rel_change * abs(old) and delta > 0.0:
+            return True
+        return False
+
+    def publish(self, name, value, quality=None):
+        # value None means invalid reading, last pushed value is sent with ATTR_INVALID quality
+        if name not in self.deadbands:
+            return False
+        last = self.last.get(name)
+        if quality is None:
+            quality = AttrQuality.ATTR_VALID if value is not None else AttrQuality.ATTR_INVALID
+        if value is None:
+            if last is None:
+                return False
+            value = last[0]
+        if last is not None and last[1] == quality and not self.changed(name, last[0], value):
+            self.skipped += 1
+            return False
+        try:
+            t = time.time()
+            self.device.push_change_event(name, value, t, quality)
+            self.device.push_archive_event(name, value, t, quality)
+            self.last[name] = (value, quality)
+            self.pushed += 1
+            return True
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'Event push error for {name}')
+            return False
+
+    def publish_all(self, values: dict):
+        n = 0
+        for name in values:
+            if self.publish(name, values[name]):
+                n += 1
+        return n
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import math
+import time
+from bisect import bisect_left
+from threading import Lock
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'Serial transaction latency metrics'
+APPLICATION_NAME_SHORT = 'DeviceMetrics'
+APPLICATION_VERSION = '1.0'
+
+# histogram bucket upper bounds, ms
+LATENCY_BUCKETS = (1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0, 200.0, 500.0, 1000.0, 2000.0, float('inf'))
+# number of distinct commands tracked per device, the rest go to 'other'
+MAX_COMMANDS = 64
+COUNTERS = ('transactions', 'errors', 'retries', 'timeouts', 'adr_switches', 'suspends')
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.n = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def record(self, dt_ms):
+        self.counts[bisect_left(LATENCY_BUCKETS, dt_ms)] += 1
+        self.n += 1
+        self.sum += dt_ms
+        if dt_ms < self.min:
+            self.min = dt_ms
+        if dt_ms > self.max:
+            self.max = dt_ms
+
+    def percentile(self, p):
+        # upper bound of the bucket containing p-th percentile
+        if self.n <= 0:
+            return float('nan')
+        k = p / 100.0 * self.n
+        s = 0
+        for i, c in enumerate(self.counts):
+            s += c
+            if s >= k:
+                return min(LATENCY_BUCKETS[i], self.max)
+        return self.max
+
+    def as_dict(self):
+        return {'n': self.n,
+                'mean': self.sum / self.n if self.n > 0 else float('nan'),
+                'min': self.min if self.n > 0 else float('nan'),
+                'max': self.max,
+                'p50': self.percentile(50.0),
+                'p95': self.percentile(95.0),
+                'buckets': {str(b): c for b, c in zip(LATENCY_BUCKETS, self.counts) if c > 0}}
+
+
+class DeviceMetrics:
+    # Per device (port:address) latency histograms and event counters.
+    # Updated by drivers in the transaction hot path and read by server threads.
+    # Not lock free: record, count, reset and as_dict take the per device lock (about 2 us per record).
+    _registry = {}
+    _lock = Lock()
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = Lock()
+        self.reset()
+
+    @staticmethod
+    def get(port, addr):
+        # the same object for the same port:address, survives device re-creation
+        name = f'{str(port).strip()}:{addr}'
+        with DeviceMetrics._lock:
+            if name not in DeviceMetrics._registry:
+                DeviceMetrics._registry[name] = DeviceMetrics(name)
+            return DeviceMetrics._registry[name]
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.time()
+            self.latency = LatencyHistogram()
+            self.commands = {}
+            self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def record(self, command, dt, ok=True):
+        # dt in seconds
+        dt_ms = dt * 1000.0
+        with self.lock:
+            self.counters['transactions'] += 1
+            if not ok:
+                self.counters['errors'] += 1
+            self.latency.record(dt_ms)
+            if command not in self.commands:
+                if len(self.commands) >= MAX_COMMANDS:
+                    command = 'other'
+                self.commands.setdefault(command, LatencyHistogram())
+            self.commands[command].record(dt_ms)
+
+    def count(self, counter, n=1):
+        with self.lock:
+            self.counters[counter] += n
+
+    def mean_latency(self):
+        # ms
+        return self.latency.sum / self.latency.n if self.latency.n > 0 else float('nan')
+
+    def as_dict(self):
+        with self.lock:
+            return {'device': self.name,
+                    'period': time.time() - self.start_time,
+                    'counters': dict(self.counters),
+                    'latency': self.latency.as_dict(),
+                    'commands': {c: h.as_dict() for c, h in self.commands.items()}}
+
+    def as_json(self):
+        return json.dumps(json_safe(self.as_dict()), allow_nan=False)
+
+    @staticmethod
+    def all():
+        with DeviceMetrics._lock:
+            devices = list(DeviceMetrics._registry.values())
+        return {d.name: d.as_dict() for d in devices}
+
+    @staticmethod
+    def report():
+        # one line per device, slowest first
+        lines = ['%-20s %8s %6s %6s %6s %6s %8s %8s %8s' %
+                 ('device', 'trans', 'err', 'retry', 'tout', 'adr', 'mean ms', 'p95 ms', 'max ms')]
+        rows = sorted(DeviceMetrics.all().values(), key=lambda d: -(d['latency']['mean'] if d['latency']['n'] else 0.0))
+        for d in rows:
+            c = d['counters']
+            lt = d['latency']
+            lines.append('%-20s %8d %6d %6d %6d %6d %8.1f %8.1f %8.1f' %
+                         (d['device'], c['transactions'], c['errors'], c['retries'], c['timeouts'],
+                          c['adr_switches'], lt['mean'], lt['p95'], lt['max']))
+        return '\n'.join(lines)
+
+
+def json_safe(value):
+    # NaN and infinity are not valid JSON, they are reported as null
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {k: json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(v) for v in value]
+    return value
+
+
+def command_name(cmd):
+    # b'PV 1.0\r' -> 'PV', b'MC?\r' -> 'MC?'
+    if isinstance(cmd, (bytes, bytearray)):
+        cmd = bytes(cmd).decode(errors='replace')
+    cmd = str(cmd).strip()
+    cmd = cmd.split(' ', 1)[0].split('=', 1)[0]
+    # drop framing control characters, e.g. LAUDA EOT/ENQ/STX
+    return ''.join(c for c in cmd if c.isprintable())[:16]
+
+
+if __name__ == "__main__":
+    import random
+
+    m = DeviceMetrics.get('COM1', 6)
+    for i in range(1000):
+        m.record(command_name(random.choice([b'PV?\r', b'MC?\r', b'PV 1.0\r'])), random.uniform(0.005, 0.05))
+    m.count('adr_switches', 10)
+    t_0 = time.perf_counter()
+    for i in range(100000):
+        m.record('PV?', 0.01)
+    print('record %5.2f us' % ((time.perf_counter() - t_0) * 10.0))
+    print(DeviceMetrics.report())
+    print(json.dumps(m.as_dict()['commands']['PV?']))
+    print(DeviceMetrics.get('COM1', 7).as_json())
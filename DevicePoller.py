@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
+
+import time
+from collections import namedtuple
+from threading import Event, Thread
+
+from config_logger import config_logger
+from log_exception import log_exception
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'Background device polling thread'
+APPLICATION_NAME_SHORT = 'DevicePoller'
+APPLICATION_VERSION = '1.0'
+
+# values - whatever read function returns, time - time.time() of the reading, valid - reading succeeded,
+# start - time.time() when the reading began, values read before a write may be delivered after it
+Snapshot = namedtuple('Snapshot', ['values', 'time', 'valid', 'start'], defaults=(0.0,))
+
+
+class DevicePoller(Thread):
+    # Calls read function every period seconds and replaces self.snapshot with the new reading.
+    # Snapshot is immutable and replaced by single assignment, so readers never see partial data.
+    def __init__(self, read, period=0.5, name='DevicePoller', logger=None, validate=None, callback=None):
+        super().__init__(name=name, daemon=True)
+        self.read = read
+        self.validate = validate
+        # callback(snapshot) is called in poller thread after each reading, e.g. to push events
+        self.callback = callback
+        self.period = period
+        self.logger = logger if logger is not None else config_logger()
+        self.snapshot = Snapshot(None, 0.0, False)
+        self.stopped = Event()
+        self.wakeup = Event()
+
+    def poll(self):
+        start = time.time()
+        try:
+            values = self.read()
+            if self.validate is None:
+                valid = values is not None
+            else:
+                valid = self.validate(values)
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'{self.name} polling error')
+            values = self.snapshot.values
+            valid = False
+        self.snapshot = Snapshot(values, time.time(), valid, start)
+        if self.callback is not None:
+            try:
+                self.callback(self.snapshot)
+            except KeyboardInterrupt:
+                raise
+            except:
+                log_exception(self.logger, f'{self.name} callback error')
+        return self.snapshot
+
+    def run(self):
+        while not self.stopped.is_set():
+            t0 = time.time()
+            self.poll()
+            self.wakeup.wait(max(0.0, self.period - (time.time() - t0)))
+            self.wakeup.clear()
+
+    def refresh(self):
+        # poll as soon as possible, e.g. after a setpoint change
+        self.wakeup.set()
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        self.wakeup.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def age(self):
+        return time.time() - self.snapshot.time
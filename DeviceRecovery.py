@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
+
+import time
+import weakref
+from threading import Condition, Lock, Thread
+
+from config_logger import config_logger
+from log_exception import log_exception
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'Background recovery of suspended devices'
+APPLICATION_NAME_SHORT = 'DeviceRecovery'
+APPLICATION_VERSION = '1.0'
+
+
+class DeviceRecovery:
+    # One worker thread per port re-probes suspended devices by device.recover() off the request path.
+    # Failed attempts are repeated with exponential backoff: suspend_delay * 2**attempt, up to MAX_DELAY.
+    # Device stays not ready (requests fail immediately) until recover() returns True.
+    _workers = {}
+    _lock = Lock()
+    MAX_DELAY = 60.0
+    logger = None
+
+    def __init__(self, port):
+        self.port = port
+        # {device: [next attempt time, attempt]}, weak keys: deleted device does not stay in recovery
+        self.pending = weakref.WeakKeyDictionary()
+        self.condition = Condition()
+        self.thread = Thread(target=self.run, daemon=True, name=f'DeviceRecovery {port}')
+        self.thread.start()
+
+    @staticmethod
+    def submit(device):
+        # schedule recovery of the device, repeated submits are ignored while recovery is pending
+        if DeviceRecovery.logger is None:
+            DeviceRecovery.logger = config_logger()
+        port = str(device.port).strip()
+        with DeviceRecovery._lock:
+            if port not in DeviceRecovery._workers:
+                DeviceRecovery._workers[port] = DeviceRecovery(port)
+            worker = DeviceRecovery._workers[port]
+        with worker.condition:
+            if device in worker.pending:
+                return False
+            worker.pending[device] = [time.time(), 0]
+            worker.condition.notify()
+        return True
+
+    @staticmethod
+    def cancel(device):
+        with DeviceRecovery._lock:
+            worker = DeviceRecovery._workers.get(str(device.port).strip())
+        if worker is None:
+            return False
+        with worker.condition:
+            return worker.pending.pop(device, None) is not None
+
+    @staticmethod
+    def pending_devices():
+        with DeviceRecovery._lock:
+            workers = list(DeviceRecovery._workers.values())
+        result = []
+        for w in workers:
+            with w.condition:
+                result.extend(w.pending)
+        return result
+
+    def run(self):
+        while True:
+            # drop the reference to the previous device before waiting
+            device = None
+            with self.condition:
+                while True:
+                    now = time.time()
+                    due = min(((t, d) for d, (t, n) in self.pending.items()), key=lambda x: x[0], default=None)
+                    if due is None:
+                        self.condition.wait()
+                    elif due[0] <= now:
+                        device = due[1]
+                        break
+                    else:
+                        # no strong reference to the device while waiting
+                        t = due[0]
+                        due = None
+                        self.condition.wait(t - now)
+                attempt = self.pending[device][1]
+            t0 = time.time()
+            try:
+                result = device.recover()
+            except KeyboardInterrupt:
+                raise
+            except:
+                log_exception(self.logger, f'{device.pre} recovery exception')
+                result = False
+            with self.condition:
+                if device not in self.pending:
+                    # cancelled during recovery
+                    continue
+                if result:
+                    self.pending.pop(device)
+                    self.logger.info('%s recovered in %5.2f s after %d attempts', device.pre, time.time() - t0,
+                                     attempt + 1)
+                    continue
+                delay = min(device.suspend_delay * 2 ** attempt, self.MAX_DELAY)
+                self.pending[device] = [time.time() + delay, attempt + 1]
+            self.logger.debug('%s recovery attempt %d failed, next in %5.2f s', device.pre, attempt + 1, delay)
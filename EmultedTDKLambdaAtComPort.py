@@ -1,13 +1,30 @@
 # -*- coding: utf-8 -*-
 
+import random
 import time
 from threading import Lock
 
 COMMANDS = (b'DVC?', b'PV?', b'MV?', b'PC?', b'MC?', b'IDN?', b'SN?', b'OUT?', b'RST')
+# start + 8 data + stop bits
+BITS_PER_BYTE = 10
 
 class EmultedTDKLambdaAtComPort:
     SN = 123456
     RESPONSE_DELAY = 0.035
+    # random extra delay 0..JITTER s, share of commands answered with error,
+    # baud rate for command and response transfer time (0 - no transfer time)
+    JITTER = 0.0
+    ERROR_RATE = 0.0
+    BAUDRATE = 0
+    # byte timing mode (needs BAUDRATE): response bytes arrive one by one, read(size) returns at most size bytes;
+    # RS485 transmitter turnaround before response and extra gap between bytes, s
+    BYTE_TIMING = False
+    TURNAROUND = 0.0
+    INTER_BYTE_GAP = 0.0
+    # fault injection, share of responses: not answered, with one byte lost, with corrupted checksum (or data)
+    TIMEOUT_RATE = 0.0
+    DROP_RATE = 0.0
+    GARBLE_RATE = 0.0
     ID = b'FAKELAMBDA GEN10-100'
 
     def __init__(self, port, *args, **kwargs):
@@ -25,6 +42,11 @@ class EmultedTDKLambdaAtComPort:
         self.id = {}
         self.t = {}
         self.write_error = False
+        # response is available after ready_time
+        self.ready_time = 0.0
+        self.pending = None
+        self.sent = 0
+        self.checksum = False
         self.add_device()
 
     def open(self):
@@ -47,8 +69,19 @@ class EmultedTDKLambdaAtComPort:
             EmultedTDKLambdaAtComPort.SN += 1
 
     def write(self, cmd, timeout=None):
-        self.last_write = cmd
         self.write_error = False
+        self.pending = None
+        self.ready_time = time.perf_counter() + self.RESPONSE_DELAY
+        if self.JITTER > 0.0:
+            self.ready_time += random.uniform(0.0, self.JITTER)
+        if self.BAUDRATE > 0:
+            self.ready_time += len(cmd) * BITS_PER_BYTE / self.BAUDRATE
+        length = len(cmd)
+        # command with checksum 'CMD$XX\r', response will have checksum too
+        self.checksum = b'$' in cmd
+        if self.checksum:
+            cmd = cmd[:cmd.index(b'$')] + b'\r'
+        self.last_write = cmd
         try:
             if self.last_write.startswith(b'ADR '):
                 self.last_address = int(self.last_write[4:])
@@ -65,18 +98,66 @@ class EmultedTDKLambdaAtComPort:
                 if cmd[:-1] not in COMMANDS:
                     self.write_error = True
             self.t[self.last_address] = time.perf_counter()
-            return len(cmd)
+            return length
         except:
             self.write_error = True
             self.t[self.last_address] = time.perf_counter()
-            return len(cmd)
+            return length
 
     def read(self, size=1, timeout=None):
-        if self.last_write == b'':
+        if self.BYTE_TIMING and self.BAUDRATE > 0:
+            return self.read_bytes(size)
+        if self.pending is None:
+            if self.last_write == b'' or time.perf_counter() < self.ready_time:
+                return b''
+            self.pending = self.inject_faults(self.response())
+            if self.BAUDRATE > 0:
+                self.ready_time += len(self.pending) * BITS_PER_BYTE / self.BAUDRATE
+        if time.perf_counter() < self.ready_time:
             return b''
-        if time.perf_counter() - self.t[self.last_address] < self.RESPONSE_DELAY:
+        result = self.pending
+        self.pending = None
+        return result
+
+    def read_bytes(self, size=1):
+        # bytes received by now, byte i arrives at ready_time + TURNAROUND + (i + 1) * byte time
+        t = time.perf_counter()
+        if self.pending is None:
+            if self.last_write == b'' or t < self.ready_time:
+                return b''
+            self.pending = self.inject_faults(self.response())
+            self.sent = 0
+        byte_time = BITS_PER_BYTE / self.BAUDRATE + self.INTER_BYTE_GAP
+        arrived = min(len(self.pending), int((t - self.ready_time - self.TURNAROUND) / byte_time))
+        n = max(0, min(size, arrived - self.sent))
+        result = self.pending[self.sent:self.sent + n]
+        self.sent += n
+        if self.sent >= len(self.pending):
+            self.pending = None
+        return result
+
+    def inject_faults(self, response):
+        if self.TIMEOUT_RATE > 0.0 and random.random() < self.TIMEOUT_RATE:
             return b''
+        if self.checksum and response:
+            body = response[:-1]
+            response = body + b'$' + (b'%02X' % (sum(body) & 0xFF)) + response[-1:]
+        if self.GARBLE_RATE > 0.0 and random.random() < self.GARBLE_RATE and len(response) > 1:
+            # corrupt checksum digit if present, data byte otherwise
+            i = response.find(b'$') + 1
+            if i <= 0:
+                i = random.randrange(len(response) - 1)
+            response = response[:i] + (b'Z' if response[i:i + 1] != b'Z' else b'Y') + response[i + 1:]
+        if self.DROP_RATE > 0.0 and random.random() < self.DROP_RATE and response:
+            i = random.randrange(len(response))
+            response = response[:i] + response[i + 1:]
+        return response
+
+    def response(self):
         self.t[self.last_address] = time.perf_counter()
+        if self.ERROR_RATE > 0.0 and random.random() < self.ERROR_RATE:
+            self.last_write = b''
+            return b'E01\r'
         if self.write_error:
             self.last_write = b''
             return b'E1\r'
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import re
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'TDK Lambda GEN protocol response parser'
+APPLICATION_NAME_SHORT = 'GenParser'
+APPLICATION_VERSION = '1.0'
+
+NAN = float('nan')
+# DVC? reply fields, parse_dvc returns list of floats in this order
+DVC_FIELDS = ('voltage', 'programmed_voltage', 'current', 'programmed_current', 'ovp', 'uvl')
+NAN_DVC = (NAN,) * len(DVC_FIELDS)
+
+# 'payload[$XX]\r', used for checksum frames only: on the hot path it is slower than bytes methods
+FRAME_RE = re.compile(rb'([^$\r]*)(?:\$([0-9A-F]{2}))?\r')
+
+
+def checksum(payload):
+    # GEN checksum: sum of payload bytes modulo 256 as two upper case hex digits
+    return b'%02X' % (sum(payload) & 0xFF)
+
+
+def parse_frame(buffer, check=False):
+    # returns payload or None if terminator or checksum is wrong
+    m = FRAME_RE.fullmatch(buffer)
+    if m is None:
+        return None
+    payload = m.group(1)
+    if check and (m.group(2) is None or checksum(payload) != m.group(2)):
+        return None
+    return payload
+
+
+def parse_dvc(buffer, check=False):
+    # [MV, PV, MC, PC, OVP, UVL] from reply with or without CR (float() ignores it),
+    # NAN for missing or wrong fields. check - reply with '$XX' checksum, None for wrong frame
+    if check:
+        buffer = parse_frame(buffer, True)
+        if buffer is None:
+            return None
+    fields = buffer.split(b',')
+    # one conversion pass for the complete reply
+    if len(fields) == 6:
+        try:
+            return [*map(float, fields)]
+        except ValueError:
+            pass
+    # slow path for incomplete or non-standard replies
+    values = []
+    for f in fields[:6]:
+        try:
+            values.append(float(f))
+        except ValueError:
+            values.append(NAN)
+    values.extend([NAN] * (6 - len(values)))
+    return values
+
+
+if __name__ == "__main__":
+    import time
+
+    reply = b'10.000000, 10.000000, 99.500000, 100.000000, 0.0, 0.0\r'
+    print(parse_dvc(reply))
+    print(parse_dvc(b'1.0, 2.0, x\r'))
+    framed = reply[:-1] + b'$' + checksum(reply[:-1]) + b'\r'
+    print(parse_dvc(framed, True), parse_dvc(framed[:-3] + b'00\r', True))
+
+    def split_parse(r):
+        vals = []
+        for s in r.split(b','):
+            try:
+                v = float(s)
+            except:
+                v = NAN
+            vals.append(v)
+        if len(vals) <= 6:
+            vals = [*vals, *[NAN] * 6]
+        return vals[:6]
+
+    # best of 5 runs, read_all passes reply with CR, read_status (execute_batch) without it
+    N = 100000
+    for name, f, r in (('split', split_parse, reply), ('parse_dvc', parse_dvc, reply),
+                       ('parse_dvc no CR', parse_dvc, reply[:-1])):
+        best = float('inf')
+        for k in range(5):
+            t_0 = time.perf_counter()
+            for i in range(N):
+                f(r)
+            best = min(best, time.perf_counter() - t_0)
+        print('%-16s %5.2f us' % (name, best / N * 1e6))
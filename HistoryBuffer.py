@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import time
+from threading import Lock
+
+import numpy
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'Fixed size measurement history'
+APPLICATION_NAME_SHORT = 'HistoryBuffer'
+APPLICATION_VERSION = '1.0'
+
+COLUMNS = ('time', 'voltage', 'programmed_voltage', 'current', 'programmed_current')
+
+
+class HistoryBuffer:
+    # Ring buffer of size rows (time, values...), memory is allocated once: size * (len(columns) + 1) * 8 bytes.
+    # Filled by acquisition thread, window() copies only the requested rows.
+    # Rows are searched by time.monotonic() index, as wall time in column 0 may step back (NTP, manual set).
+    def __init__(self, size=3600, columns=COLUMNS):
+        self.columns = columns
+        self.size = max(1, int(size))
+        self.data = numpy.full((self.size, len(columns)), numpy.nan)
+        self.index = numpy.full(self.size, numpy.nan)
+        # number of rows appended since creation, next row goes to count % size
+        self.count = 0
+        self.lock = Lock()
+
+    def append(self, t, values, index=None):
+        # t - wall time for display, index - monotonic time, now if None. NaN values mark gaps of invalid readings
+        if index is None:
+            index = time.monotonic()
+        with self.lock:
+            n = self.count % self.size
+            row = self.data[n]
+            row[0] = t
+            row[1:] = values
+            self.index[n] = index
+            self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def ranges(self):
+        # chronological order of stored rows as at most two (first, last + 1) ranges
+        n = self.count % self.size
+        if self.count <= self.size:
+            return ((0, self.count),)
+        return (n, self.size), (0, n)
+
+    def window(self, start=None, end=None):
+        # rows with start <= monotonic index <= end as (n, len(columns)) array, None - unlimited
+        with self.lock:
+            parts = []
+            for a, b in self.ranges():
+                t = self.index[a:b]
+                i = 0 if start is None else numpy.searchsorted(t, start, 'left')
+                j = len(t) if end is None else numpy.searchsorted(t, end, 'right')
+                if j > i:
+                    parts.append(self.data[a + i:a + j])
+            if not parts:
+                return numpy.empty((0, len(self.columns)))
+            if len(parts) == 1:
+                return parts[0].copy()
+            return numpy.concatenate(parts)
+
+    def last(self, seconds):
+        return self.window(time.monotonic() - seconds)
+
+    def clear(self):
+        with self.lock:
+            self.data.fill(numpy.nan)
+            self.index.fill(numpy.nan)
+            self.count = 0
+
+
+if __name__ == "__main__":
+    h = HistoryBuffer(1000)
+    t_0 = 1000.0
+    for i in range(2500):
+        h.append(t_0 + i * 0.5, (i, i, -i, -i), t_0 + i * 0.5)
+    w = h.window(t_0 + 1000.0, t_0 + 1010.0)
+    print(len(h), h.data.nbytes + h.index.nbytes, w.shape, w[0], w[-1])
+    w = h.window(t_0 + 700.0)
+    print(w.shape, w[0, 0], w[-1, 0], bool(numpy.all(numpy.diff(w[:, 0]) > 0)))
+    # wall clock set back by an hour, monotonic index keeps growing
+    for i in range(10):
+        h.append(t_0 + 1250.0 - 3600.0 + i, (i, i, -i, -i), t_0 + 1250.0 + i)
+    w = h.window(t_0 + 1245.0)
+    print(w.shape, w[0, 0], w[-1, 0])
+    t_1 = time.perf_counter()
+    for i in range(10000):
+        h.append(t_0 + 2500.0 + i, (1.0, 2.0, 3.0, 4.0), t_0 + 2500.0 + i)
+    print('append %5.2f us' % ((time.perf_counter() - t_1) * 100.0))
+    t_1 = time.perf_counter()
+    for i in range(1000):
+        h.window(t_0 + 12000.0)
+    print('window of %d rows %5.2f us' % (len(h.window(t_0 + 12000.0)), (time.perf_counter() - t_1) * 1000.0))
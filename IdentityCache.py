@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
+
+import json
+import os
+import tempfile
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from config_logger import config_logger
+from log_exception import log_exception
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'Persistent device identity cache'
+APPLICATION_NAME_SHORT = 'IdentityCache'
+APPLICATION_VERSION = '1.0'
+
+
+class IdentityCache:
+    # On-disk {'port:addr': {'type': class name, ...identity...}} used to skip re-probing on restart.
+    # Records are validated by the drivers with a cheap probe (serial number, module name).
+    FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'identity_cache.json')
+    _lock = Lock()
+    _data = None
+    logger = None
+
+    @staticmethod
+    def key(port, addr):
+        return f'{str(port).strip()}:{addr}'
+
+    @staticmethod
+    def log_error(message):
+        if IdentityCache.logger is None:
+            IdentityCache.logger = config_logger()
+        log_exception(IdentityCache.logger, message)
+
+    @staticmethod
+    def _read():
+        try:
+            if os.path.exists(IdentityCache.FILE):
+                with open(IdentityCache.FILE, 'r') as f:
+                    return json.load(f)
+        except KeyboardInterrupt:
+            raise
+        except:
+            IdentityCache.log_error(f'Identity cache {IdentityCache.FILE} read error')
+        return {}
+
+    @staticmethod
+    def _load():
+        # called with _lock acquired
+        if IdentityCache._data is None:
+            IdentityCache._data = IdentityCache._read()
+        return IdentityCache._data
+
+    @staticmethod
+    def _update(func):
+        # called with _lock acquired. Several server processes share the file:
+        # under the file lock re-read it, apply func(data) and write via unique temporary file
+        try:
+            with open(IdentityCache.FILE + '.lock', 'a+') as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+                else:
+                    lock.seek(0)
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    data = IdentityCache._read()
+                    if func(data):
+                        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(IdentityCache.FILE),
+                                                         prefix='identity_cache.', suffix='.tmp',
+                                                         delete=False) as f:
+                            json.dump(data, f, indent=1)
+                        os.replace(f.name, IdentityCache.FILE)
+                    IdentityCache._data = data
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+                    else:
+                        lock.seek(0)
+                        msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+        except KeyboardInterrupt:
+            raise
+        except:
+            IdentityCache.log_error(f'Identity cache {IdentityCache.FILE} write error')
+
+    @staticmethod
+    def get(port, addr, device_type):
+        with IdentityCache._lock:
+            record = IdentityCache._load().get(IdentityCache.key(port, addr))
+            if record is None or record.get('type') != device_type:
+                return None
+            return dict(record)
+
+    @staticmethod
+    def put(port, addr, device_type, **identity):
+        with IdentityCache._lock:
+            record = dict(identity)
+            record['type'] = device_type
+            key = IdentityCache.key(port, addr)
+            if IdentityCache._load().get(key) == record:
+                return
+
+            def put_record(data):
+                if data.get(key) == record:
+                    return False
+                data[key] = record
+                return True
+
+            IdentityCache._update(put_record)
+
+    @staticmethod
+    def invalidate(port=None, addr=None):
+        # remove one record or the whole cache if port is None
+        def remove(data):
+            if port is None:
+                result = bool(data)
+                data.clear()
+                return result
+            return data.pop(IdentityCache.key(port, addr), None) is not None
+
+        with IdentityCache._lock:
+            IdentityCache._update(remove)
@@ -35,7 +35,7 @@ class Lauda(TDKLambda):
         # check device address
         if self.addr <= 0:
             self.state = -1
-            self.logger.info(f'{self.pre} ' + self.STATES[self.state])
+            self.logger.info('%s %s', self.pre, self.STATES[self.state])
             self.suspend()
             return False
         # check if port:address is in use
@@ -43,12 +43,12 @@ class Lauda(TDKLambda):
             for d in TDKLambda._devices:
                 if d != self and d.port == self.port and d.addr == self.addr and d.state > 0:
                     self.state = -2
-                    self.logger.info(f'{self.pre} ' + self.STATES[self.state])
+                    self.logger.info('%s %s', self.pre, self.STATES[self.state])
                     self.suspend()
                     return False
         if not self.com.ready:
             self.state = -5
-            self.logger.info(f'{self.pre} ' + self.STATES[self.state])
+            self.logger.info('%s %s', self.pre, self.STATES[self.state])
             self.suspend()
             return False
         # read device type
@@ -59,7 +59,7 @@ class Lauda(TDKLambda):
         #     self.suspend()
         #     return False
         self.state = 1
-        self.logger.info(f'{self.pre} has been initialized {self.read_retries} {self.read_timeout}')
+        self.logger.info('%s has been initialized %s %s', self.pre, self.read_retries, self.read_timeout)
         return True
 
     def _set_addr(self):
@@ -82,18 +82,25 @@ class Lauda(TDKLambda):
         #
         csr = self.read(1)
         if csr == b'':
-            self.logger.debug(f'{self.pre} No expected checksum in response')
+            self.logger.debug('%s No expected checksum in response', self.pre)
             return False
         cs = self.checksum(value[1:-1])
         if csr != cs:
-            self.logger.debug(f'{self.pre} Incorrect checksum in response')
+            self.logger.debug('%s Incorrect checksum in response', self.pre)
             return False
         if self.response[:1] != b'\x02':
-            self.logger.debug(f'{self.pre} Wrong response')
+            self.logger.debug('%s Wrong response', self.pre)
             return False
         return True
 
+    def is_query(self, cmd):
+        if isinstance(cmd, str):
+            cmd = cmd.encode()
+        return b'=' not in cmd
+
     def send_command(self, cmd) -> bool:
+        if self.scheduler is not None and not self.scheduler.in_worker():
+            return self.schedule(Lauda.send_command, cmd, self.is_query(cmd))
         self.response = b''
         # unify command
         if isinstance(cmd, str):
@@ -118,13 +125,15 @@ class Lauda(TDKLambda):
                 result = self._send_command(cmd_out, terminator=t)
                 if result:
                     return True
-                self.logger.info(f'{self.pre} Command {cmd} retry {n} of {self.read_retries}')
+                if n < self.read_retries:
+                    self.metrics.count('retries')
+                self.logger.info('%s Command %s retry %s of %s', self.pre, cmd, n, self.read_retries)
             if b'=' in self.command and self.response == b'\x15':
-                self.logger.debug(f'{self.pre} Unrecognized command {cmd}')
+                self.logger.debug('%s Unrecognized command %s', self.pre, cmd)
                 return False
             self.response = b''
             self.suspend()
-            self.logger.info(f'{self.pre} Can not send command {cmd}')
+            self.logger.info('%s Can not send command %s', self.pre, cmd)
             return False
         except KeyboardInterrupt:
             raise
@@ -168,8 +177,7 @@ class Lauda(TDKLambda):
                 raise
             except:
                 pass
-        msg = f'{self.pre} {param} read error'
-        self.logger.debug(msg)
+        self.logger.debug('%s %s read error', self.pre, param)
         return None
 
     def read_bit(self, param: str, n):
@@ -184,23 +192,20 @@ class Lauda(TDKLambda):
                 raise
             except:
                 pass
-        msg = f'{self.pre} p{param} read error'
-        self.logger.debug(msg)
+        self.logger.debug('%s p%s read error', self.pre, param)
         return None
 
     def write_value(self, param: str, value, *args):
         resp = self.send_command(f'{param}={value}')
         if resp:
             return True
-        msg = f'{self.pre} {param} write error'
-        self.logger.debug(msg)
+        self.logger.debug('%s %s write error', self.pre, param)
         return False
 
     def write_bit(self, param: str, bit, value):
         v0 = self.read_value(param, int)
         if v0 is None:
-            msg = f'{self.pre} {param}_{bit} write error'
-            self.logger.debug(msg)
+            self.logger.debug('%s %s_%s write error', self.pre, param, bit)
             return False
         if value:
             v1 = int(v0) | 2 ** bit
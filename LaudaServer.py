@@ -3,8 +3,11 @@
 """
 LAUDA tango device server
 """
+import json
 import os
 import sys
+import time
+from threading import Lock
 
 if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
 
@@ -12,7 +15,10 @@ from tango import Attribute, AttrQuality, AttrWriteType, DispLevel
 from tango import DevState
 from tango.server import attribute, command
 
+from AdaptiveTimeout import AdaptiveTimeout
 from TangoServerPrototype import TangoServerPrototype
+from ChangePublisher import ChangePublisher
+from DevicePoller import DevicePoller
 from Lauda import Lauda
 
 ORGANIZATION_NAME = 'BINP'
@@ -25,6 +31,19 @@ LAUDA_DEFAULT_ADDRESS =  5
 LAUDA_DEFAULT_BAUD =  38400
 LAUDA_DEFAULT_READ_TIMEOUT = 1.0
 LAUDA_DEFAULT_READ_RETRIES =  2
+LAUDA_DEFAULT_EVENT_PERIOD = 1.0
+
+# attribute name: (parameter, bit or None for value)
+LAUDA_EVENT_ATTRIBUTES = {'set_point': ('1100', None),
+                          'set_point_remote': ('6200', None),
+                          'enable': ('6210', 0),
+                          'run': ('6210', 1),
+                          'reset': ('6210', 2),
+                          'valve': ('6210', 3),
+                          'pump': ('6230', 0),
+                          'valve_state': ('6230', 7),
+                          'return_temp': ('1012', None),
+                          'output_temp': ('1011', None)}
 
 
 class LaudaServer(TangoServerPrototype):
@@ -43,6 +62,12 @@ class LaudaServer(TangoServerPrototype):
                         unit="", format="%d",
                         doc="LAUDA address (Default 5)")
 
+    mean_latency = attribute(label="Mean latency", dtype=float,
+                             display_level=DispLevel.EXPERT,
+                             access=AttrWriteType.READ,
+                             unit="ms", format="%6.1f",
+                             doc="Mean serial transaction time, see read_metrics command for details")
+
     device_type = attribute(label="LAUDA Type", dtype=str,
                             display_level=DispLevel.OPERATOR,
                             access=AttrWriteType.READ,
@@ -125,10 +150,39 @@ class LaudaServer(TangoServerPrototype):
         kwargs['baudrate'] = baud
         kwargs['logger'] = self.logger
         kwargs['read_timeout'] = self.config.get('read_timeout', LAUDA_DEFAULT_READ_TIMEOUT)
+        # adaptive read timeout between min_timeout and read_timeout
+        kwargs['adaptive_timeout'] = self.config.get('adaptive_timeout', False)
+        kwargs['min_timeout'] = self.config.get('min_timeout', AdaptiveTimeout.FLOOR)
+        # PortBroker address to share the port with other server processes, '' - direct access
+        kwargs['broker'] = self.config.get('broker', '')
+        # shared connection with keep-alive and reconnect backoff for host:port ports
+        kwargs['tcp_pool'] = self.config.get('tcp_pool', False)
+        # re-probe suspended device by background DeviceRecovery worker instead of inline in requests
+        kwargs['background_recovery'] = self.config.get('background_recovery', False)
         kwargs['read_retries'] = self.config.get('read_retries', LAUDA_DEFAULT_READ_RETRIES)
         # create LAUDA device
+        self.lock = Lock()
         self.lda = Lauda(port, addr, **kwargs)
         self.pre = f'{self.get_name()} {self.lda.pre}'
+        # acquisition loop reads all parameters and pushes change/archive events,
+        # attribute reads are served from its snapshot, event_period <= 0 disables it
+        self.publisher = ChangePublisher(self, self.config.get('abs_change', 0.0),
+                                         self.config.get('rel_change', 0.0), logger=self.logger)
+        try:
+            self.publisher.deadbands.update(json.loads(self.config.get('deadbands', '{}')))
+        except KeyboardInterrupt:
+            raise
+        except:
+            # wrong property value should not prevent device creation
+            self.log_exception('Wrong deadbands property, ignored')
+        self.event_period = self.config.get('event_period', LAUDA_DEFAULT_EVENT_PERIOD)
+        self.poller = None
+        self.write_time = 0.0
+        if self.event_period > 0.0:
+            for name in LAUDA_EVENT_ATTRIBUTES:
+                self.publisher.configure(name)
+            self.poller = DevicePoller(self.acquire, self.event_period, name=f'{self.get_name()} acquisition',
+                                       logger=self.logger, callback=self.publish_events)
         # check if device OK
         if self.lda.ready:
             self.set_point.set_write_value(self.read_set_point())
@@ -145,8 +199,13 @@ class LaudaServer(TangoServerPrototype):
             msg = 'Created with errors'
             self.set_state(DevState.FAULT, msg)
             self.log_error(msg)
+        # acquisition runs for not ready device too, snapshots become valid after its recovery
+        if self.poller is not None:
+            self.poller.start()
 
     def delete_device(self):
+        if self.poller is not None:
+            self.poller.stop(2.0 * self.event_period + self.lda.read_timeout)
         self.lda.__del__()
         super().delete_device()
         msg = 'Device has been deleted'
@@ -185,14 +244,27 @@ class LaudaServer(TangoServerPrototype):
             self.log_debug(msg)
         return self.set_attribute_value(attr, val)
 
-    def read_value(self, param: str, type=float):
-        resp = self.lda.send_command(param)
-        if resp:
+    def read_raw(self, param: str, cached=True):
+        # parameter value string from acquisition snapshot if it is fresh, or from device
+        if cached and self.poller is not None:
+            snapshot = self.poller.snapshot
+            # snapshot which acquisition began before the last write is outdated
+            if snapshot.values and snapshot.start > self.write_time and \
+                    time.time() - snapshot.time <= 2.0 * self.event_period:
+                v = snapshot.values.get(param)
+                if v is not None:
+                    return v
+        with self.lock:
+            resp = self.lda.send_command(param)
+            if resp:
+                return self.lda.get_response().split('=')[-1]
+        return None
+
+    def read_value(self, param: str, type=float, cached=True):
+        v = self.read_raw(param, cached)
+        if v is not None:
             try:
-                v = self.lda.get_response()
-                v1 = v.split('=')
-                value = type(v1[-1])
-                return value
+                return type(v)
             except KeyboardInterrupt:
                 raise
             except:
@@ -202,20 +274,33 @@ class LaudaServer(TangoServerPrototype):
         return None
 
     def read_bit(self, param: str, n):
-        resp = self.lda.send_command(param)
-        if resp:
+        value = self.read_value(param, int)
+        if value is not None:
+            return bool(value & 2 ** n)
+        return None
+
+    def acquire(self):
+        # executed in acquisition thread only, returns {param: value string or None}
+        values = {}
+        for param, n in LAUDA_EVENT_ATTRIBUTES.values():
+            if param not in values:
+                values[param] = self.read_raw(param, False)
+        return values
+
+    def publish_events(self, snapshot):
+        if snapshot.values is None:
+            return
+        for name, (param, n) in LAUDA_EVENT_ATTRIBUTES.items():
+            value = None
             try:
-                v = self.lda.get_response()
-                v1 = v.split('=')
-                value = bool(int(v1[-1]) & 2 ** n)
-                return value
+                v = snapshot.values.get(param)
+                if v is not None:
+                    value = float(v) if n is None else bool(int(v) & 2 ** n)
             except KeyboardInterrupt:
                 raise
             except:
                 pass
-        msg = f'{param} read error'
-        self.log_debug(msg)
-        return None
+            self.publisher.publish(name, value)
 
     def read_set_point(self):
         value = self.read_value('1100')
@@ -320,7 +405,11 @@ class LaudaServer(TangoServerPrototype):
 
     #   ---------------- custom attributes write --------------
     def write_value(self, param: str, value):
-        resp = self.lda.send_command(f'{param}={value}')
+        with self.lock:
+            resp = self.lda.send_command(f'{param}={value}')
+        self.write_time = time.time()
+        if self.poller is not None:
+            self.poller.refresh()
         if resp:
             return True
         msg = f'{param} write error'
@@ -328,7 +417,7 @@ class LaudaServer(TangoServerPrototype):
         return False
 
     def write_bit(self, param: str, bit, value):
-        v0 = self.read_value(param, int)
+        v0 = self.read_value(param, int, cached=False)
         if v0 is None:
             msg = f'{param}_{bit} write error'
             self.log_debug(msg)
@@ -420,11 +509,29 @@ class LaudaServer(TangoServerPrototype):
                 msg = f'was not initialized'
         super().set_fault(msg)
 
+    def read_mean_latency(self):
+        return self.lda.metrics.mean_latency()
+
+    @command(dtype_in=None, dtype_out=str,
+             doc_out='JSON transaction metrics: latency histograms per command, retries, timeouts, ADR switches, suspends')
+    def read_metrics(self):
+        return self.lda.metrics.as_json()
+
+    @command(dtype_in=None, dtype_out=None, doc_out='Reset transaction metrics')
+    def reset_metrics(self):
+        self.lda.metrics.reset()
+
+    @command(dtype_in=None, dtype_out=str,
+             doc_out='JSON learned read timeouts: latency estimates and timeout per command class')
+    def read_timeouts(self):
+        return self.lda.timeouts.as_json()
+
     @command(dtype_in=str, doc_in='Directly send command to the LAUDA',
              dtype_out=str, doc_out='Response from LAUDA PS without final <CR>')
     def send_command(self, cmd):
-        result = self.lda.send_command(cmd)
-        rsp = self.lda.get_response()
+        with self.lock:
+            result = self.lda.send_command(cmd)
+            rsp = self.lda.get_response()
         if result:
             msg = f'Command {cmd} executed, result {rsp}'
             self.log_debug(msg)
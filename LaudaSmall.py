@@ -8,6 +8,7 @@ from ComPort import EmptyComPort
 from config_logger import config_logger
 from log_exception import log_exception
 from Moxa import MoxaTCPComPort
+from TCPPortPool import TCPPort
 from TDKLambda import TDKLambda
 
 ORGANIZATION_NAME = 'BINP'
@@ -251,6 +252,7 @@ class LaudaSmall(TDKLambda):
             self.pre = f'LAUDA at {self.port}:{self.addr}'
             try:
                 if (self.com.device is not MoxaTCPComPort and
+                        self.com.device is not TCPPort and
                         self.com.device is not EmptyComPort and
                         int(self.addr) >= 0 and int(self.addr) < 128):
                     self.addr_prefix = ('A%03i_' % int(self.addr)).encode()
@@ -307,7 +309,14 @@ class LaudaSmall(TDKLambda):
             log_exception(self.logger)
             return 'Unknown Device'
 
+    def is_query(self, cmd):
+        if isinstance(cmd, bytes):
+            cmd = cmd.decode()
+        return not cmd.upper().startswith(WRITE_COMMANDS)
+
     def send_command(self, cmd) -> bool:
+        if self.scheduler is not None and not self.scheduler.in_worker():
+            return self.schedule(LaudaSmall.send_command, cmd, self.is_query(cmd))
         self.response = b''
         # unify command
         if isinstance(cmd, str):
@@ -323,10 +332,9 @@ class LaudaSmall(TDKLambda):
             while n < self.read_retries:
                 n += 1
                 result = self._send_command(cmd_out)
-                self.read_until(b'\n')
                 if self.response.startswith(self.addr_prefix + b'ERR'):
                     self.error = datetime.datetime.today().strftime('%Y-%m-%d %H:%M:%S') + ' ' + LAUDA_ERRORS[self.resp.encode()]
-                    self.debug(f'Error: {self.error}')
+                    self.debug('Error: %s', self.error)
                     return False
                 if cmd.decode().upper().startswith(WRITE_COMMANDS):
                     if self.response.startswith(self.addr_prefix + b'OK'):
@@ -335,9 +343,11 @@ class LaudaSmall(TDKLambda):
                 else:
                     if result:
                         return True
-                self.info(f'Command {cmd} retry {n} of {self.read_retries}')
+                if n < self.read_retries:
+                    self.metrics.count('retries')
+                self.info('Command %s retry %s of %s', cmd, n, self.read_retries)
             self.error = datetime.datetime.today().strftime('%Y-%m-%d %H:%M:%S') + ' ' + f'Can not send command {cmd}'
-            self.info(f'Can not send command {cmd}')
+            self.info('Can not send command %s', cmd)
             # self.response = b''
             self.suspend()
             return False
@@ -361,16 +371,19 @@ class LaudaSmall(TDKLambda):
                 if response.startswith(self.addr_prefix + b'ERR'):
                     self.error = datetime.datetime.today().strftime('%Y-%m-%d %H:%M:%S') + ' ' + LAUDA_ERRORS[
                         response.replace(self.addr_prefix, b'')[:-1]]
-                    self.debug(f'Error: {self.error}')
+                    self.debug('Error: %s', self.error)
                     return False
                 if response.startswith(self.addr_prefix):
                     return True
-        self.debug(f'Unexpected response {response}')
+        self.debug('Unexpected response %s', response)
         return False
 
     def _log(self, level, message='', *args, **kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
         if hasattr(self, 'pre'):
-            message = f'{self.pre} {message}'
+            message = '%s ' + message
+            args = (self.pre,) + args
         sl = kwargs.pop('stacklevel', 1)
         if sys.version_info.major >= 3 and sys.version_info.minor >= 8:
             kwargs['stacklevel'] = sl + 2
@@ -399,6 +412,8 @@ class LaudaSmall(TDKLambda):
         return b''
 
     def verify_checksum(self, value):
+        # no checksum, LF after CR is read here to keep it from being taken for stray input
+        self.read_until(b'\n')
         return True
 
     def read_value(self, command: str, result_type=float):
@@ -419,7 +434,7 @@ class LaudaSmall(TDKLambda):
         if isinstance(cmd, bytes):
             cmd = cmd.decode()
         if not cmd.startswith(WRITE_COMMANDS):
-            self.debug(f'Not write command {cmd}')
+            self.debug('Not write command %s', cmd)
             return False
         try:
             if isinstance(value, float):
@@ -131,6 +131,10 @@ class LaudaSmallServer(TangoServerPrototype):
         kwargs['logger'] = self.logger
         kwargs['read_timeout'] = self.config.get('read_timeout', LAUDA_DEFAULT_READ_TIMEOUT)
         kwargs['read_retries'] = self.config.get('read_retries', LAUDA_DEFAULT_READ_RETRIES)
+        # shared connection with keep-alive and reconnect backoff for host:port ports
+        kwargs['tcp_pool'] = self.config.get('tcp_pool', False)
+        # re-probe suspended device by background DeviceRecovery worker instead of inline in requests
+        kwargs['background_recovery'] = self.config.get('background_recovery', False)
         # create LAUDA device
         self.lda = LaudaSmall(port, addr, **kwargs)
         self.pre = f'{self.get_name()} {self.lda.pre}'
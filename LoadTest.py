@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
+
+import argparse
+import json
+import logging
+import random
+import time
+from math import isnan
+from threading import Event, Lock, Thread
+
+from DeviceMetrics import DeviceMetrics
+from EmultedTDKLambdaAtComPort import EmultedTDKLambdaAtComPort
+from TDKLambda import TDKLambda
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'TDKLambda load test on emulated COM ports'
+APPLICATION_NAME_SHORT = 'LoadTest'
+APPLICATION_VERSION = '1.0'
+
+
+class TimedLock:
+    # wraps COM port lock to measure time spent waiting for the bus
+    def __init__(self, lock):
+        self.lock = lock
+        self.waits = []
+
+    def acquire(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        result = self.lock.acquire(*args, **kwargs)
+        self.waits.append(time.perf_counter() - t0)
+        return result
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+class LoadTest:
+    def __init__(self, ports=2, addresses=4, threads=8, duration=5.0, write_ratio=0.2,
+                 delay=EmultedTDKLambdaAtComPort.RESPONSE_DELAY, jitter=0.0, error_rate=0.0, baudrate=0,
+                 first_port=100, emulator=None, **kwargs):
+        self.ports = ports
+        self.addresses = addresses
+        self.threads = threads
+        self.duration = duration
+        self.write_ratio = write_ratio
+        # emulator timing and errors
+        EmultedTDKLambdaAtComPort.RESPONSE_DELAY = delay
+        EmultedTDKLambdaAtComPort.JITTER = jitter
+        EmultedTDKLambdaAtComPort.ERROR_RATE = error_rate
+        EmultedTDKLambdaAtComPort.BAUDRATE = baudrate
+        self.config = {'ports': ports, 'addresses': addresses, 'threads': threads, 'duration': duration,
+                       'write_ratio': write_ratio, 'delay': delay, 'jitter': jitter,
+                       'error_rate': error_rate, 'baudrate': baudrate}
+        # other emulator class attributes, e.g. {'BYTE_TIMING': True, 'DROP_RATE': 0.01}
+        if emulator:
+            for key, value in emulator.items():
+                setattr(EmultedTDKLambdaAtComPort, key, value)
+            self.config.update(emulator)
+        self.logger = kwargs.pop('logger', None)
+        if self.logger is None:
+            self.logger = logging.getLogger(APPLICATION_NAME_SHORT)
+            self.logger.setLevel(logging.WARNING)
+        kwargs['logger'] = self.logger
+        kwargs.setdefault('identity_cache', False)
+        self.devices = []
+        self.locks = {}
+        for p in range(first_port, first_port + ports):
+            for a in range(1, addresses + 1):
+                d = TDKLambda(f'FAKECOM{p}', a, **kwargs)
+                if d.port not in self.locks:
+                    self.locks[d.port] = TimedLock(d.com.lock)
+                d.com.lock = self.locks[d.port]
+                self.devices.append(d)
+        self.stop = Event()
+        self.lock = Lock()
+        self.latency = []
+        self.errors = 0
+
+    def worker(self):
+        latency = []
+        errors = 0
+        while not self.stop.is_set():
+            d = random.choice(self.devices)
+            t0 = time.perf_counter()
+            if random.random() < self.write_ratio:
+                ok = d.write_voltage(round(random.uniform(0.0, 10.0), 2))
+            else:
+                ok = not any(isnan(v) for v in d.read_all()[:4])
+            latency.append(time.perf_counter() - t0)
+            if not ok:
+                errors += 1
+        with self.lock:
+            self.latency.extend(latency)
+            self.errors += errors
+
+    def run(self):
+        for lock in self.locks.values():
+            lock.waits.clear()
+        for d in self.devices:
+            d.metrics.reset()
+        workers = [Thread(target=self.worker, daemon=True) for i in range(self.threads)]
+        cpu0 = time.process_time()
+        t0 = time.perf_counter()
+        for w in workers:
+            w.start()
+        time.sleep(self.duration)
+        self.stop.set()
+        for w in workers:
+            w.join()
+        wall = time.perf_counter() - t0
+        cpu = time.process_time() - cpu0
+        transactions = sum(d.metrics.counters['transactions'] for d in self.devices)
+        waits = [w for lock in self.locks.values() for w in lock.waits]
+        counters = {k: sum(d.metrics.counters[k] for d in self.devices) for k in self.devices[0].metrics.counters}
+        return {'config': self.config,
+                'operations': len(self.latency),
+                'operations_per_s': len(self.latency) / wall,
+                'transactions_per_s': transactions / wall,
+                'p50_ms': percentile(self.latency, 50.0) * 1000.0,
+                'p99_ms': percentile(self.latency, 99.0) * 1000.0,
+                'lock_wait_mean_ms': (sum(waits) / len(waits) * 1000.0) if waits else float('nan'),
+                'lock_wait_p99_ms': percentile(waits, 99.0) * 1000.0,
+                'cpu_per_transaction_us': cpu / transactions * 1e6 if transactions else float('nan'),
+                'failed_operations': self.errors,
+                'counters': counters}
+
+
+def report(result, baseline=None):
+    keys = ('operations_per_s', 'transactions_per_s', 'p50_ms', 'p99_ms',
+            'lock_wait_mean_ms', 'lock_wait_p99_ms', 'cpu_per_transaction_us', 'failed_operations')
+    lines = [json.dumps(result['config']), json.dumps(result['counters'])]
+    for k in keys:
+        line = '%-24s %12.2f' % (k, result[k])
+        if baseline is not None and k in baseline:
+            b = baseline[k]
+            line += '   baseline %12.2f  %+7.1f %%' % (b, (result[k] - b) / b * 100.0 if b else float('nan'))
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=APPLICATION_NAME)
+    parser.add_argument('--ports', type=int, default=2, help='number of emulated COM ports')
+    parser.add_argument('--addresses', type=int, default=4, help='devices per port')
+    parser.add_argument('--threads', type=int, default=8, help='client threads')
+    parser.add_argument('--duration', type=float, default=5.0, help='test duration, s')
+    parser.add_argument('--write-ratio', type=float, default=0.2, help='share of write_voltage operations')
+    parser.add_argument('--delay', type=float, default=EmultedTDKLambdaAtComPort.RESPONSE_DELAY,
+                        help='emulated response delay, s')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra response delay, s')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of error responses')
+    parser.add_argument('--baudrate', type=int, default=0, help='emulated baud rate, 0 - no transfer time')
+    parser.add_argument('--byte-timing', action='store_true', help='deliver response byte by byte at baud rate')
+    parser.add_argument('--turnaround', type=float, default=0.0, help='RS485 turnaround before response, s')
+    parser.add_argument('--gap', type=float, default=0.0, help='inter byte gap, s')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='share of not answered commands')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='share of responses with a lost byte')
+    parser.add_argument('--garble-rate', type=float, default=0.0, help='share of responses with corrupted checksum')
+    parser.add_argument('--save', default='', help='save result to JSON file')
+    parser.add_argument('--baseline', default='', help='compare with result saved by --save')
+    args = parser.parse_args()
+
+    emulator = {'BYTE_TIMING': args.byte_timing, 'TURNAROUND': args.turnaround, 'INTER_BYTE_GAP': args.gap,
+                'TIMEOUT_RATE': args.timeout_rate, 'DROP_RATE': args.drop_rate, 'GARBLE_RATE': args.garble_rate}
+    test = LoadTest(args.ports, args.addresses, args.threads, args.duration, args.write_ratio,
+                    args.delay, args.jitter, args.error_rate, args.baudrate, emulator=emulator)
+    result = test.run()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(report(result, baseline))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=1)
+    print(DeviceMetrics.report())
@@ -6,6 +6,7 @@ if util_path not in sys.path:
     sys.path.append(util_path)
 del util_path
 
+from ModbusCRC import modbus_crc, modbus_checksum, verify_frame
 
 ORGANIZATION_NAME = 'BINP'
 APPLICATION_NAME = 'Vtimer I/O modules Python API'
@@ -13,17 +14,7 @@ APPLICATION_NAME_SHORT = 'Adam'
 APPLICATION_VERSION = '0.1'
 
 
-def modbusCRC(msg: bytes) -> int:
-    crc = 0xFFFF
-    for n in range(len(msg)):
-        crc ^= msg[n]
-        for i in range(8):
-            if crc & 1:
-                crc >>= 1
-                crc ^= 0xA001
-            else:
-                crc >>= 1
-    return crc
+modbusCRC = modbus_crc
 
 
 class MODBUS:
@@ -33,18 +24,13 @@ class MODBUS:
 
     @staticmethod
     def checksum(cmd: bytes):
-        s = 0
-        for b in cmd:
-            s += int(b)
-        #return bytes([s // 256, s % 256])
-        return modbusCRC(cmd).to_bytes(2, 'little')
+        return modbus_checksum(cmd)
 
     def add_checksum(self, cmd: bytes):
         return cmd + self.checksum(cmd)
 
     def verify_checksum(self, cmd: bytes):
-        cs = self.checksum(cmd[:-2])
-        return cmd[-2:] == cs
+        return verify_frame(cmd)
 
     def send(self, cmd: bytes) -> bool:
         ml = int.from_bytes(cmd[1:3])
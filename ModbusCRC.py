@@ -0,0 +1,88 @@
+import time
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'Modbus RTU CRC16 Python API'
+APPLICATION_NAME_SHORT = 'ModbusCRC'
+APPLICATION_VERSION = '1.0'
+
+
+def modbus_crc_bitwise(msg: bytes) -> int:
+    # reference implementation, one bit at a time
+    crc = 0xFFFF
+    for n in range(len(msg)):
+        crc ^= msg[n]
+        for i in range(8):
+            if crc & 1:
+                crc >>= 1
+                crc ^= 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+
+def _make_table():
+    table = []
+    for b in range(256):
+        crc = b
+        for i in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+        table.append(crc)
+    return tuple(table)
+
+
+CRC_TABLE = _make_table()
+
+
+def modbus_crc(msg: bytes) -> int:
+    crc = 0xFFFF
+    table = CRC_TABLE
+    for b in msg:
+        crc = (crc >> 8) ^ table[(crc ^ b) & 0xFF]
+    return crc
+
+
+def modbus_checksum(msg: bytes) -> bytes:
+    # CRC as transmitted in RTU frame, low byte first
+    return modbus_crc(msg).to_bytes(2, 'little')
+
+
+def verify_frame(frame: bytes) -> bool:
+    # frame with trailing CRC; CRC over the whole frame is 0 for a correct one
+    return len(frame) > 2 and modbus_crc(frame) == 0
+
+
+def verify_frames(frames) -> list:
+    # batch check, e.g. for frames from a capture file
+    return [verify_frame(frame) for frame in frames]
+
+
+if __name__ == "__main__":
+    cmd = bytes.fromhex('1103006B0003')
+    cs = bytes.fromhex('7687')
+    print(cmd, cs, modbus_checksum(cmd), cs == modbus_checksum(cmd), verify_frame(cmd + cs))
+    # micro benchmark against bitwise implementation
+    frames = [bytes((i * 7 + j) & 0xFF for j in range(8 + i % 32)) for i in range(2000)]
+    for f in frames:
+        assert modbus_crc(f) == modbus_crc_bitwise(f)
+    n = 5
+    t_0 = time.perf_counter()
+    for i in range(n):
+        for f in frames:
+            modbus_crc_bitwise(f)
+    dt1 = (time.perf_counter() - t_0) / (n * len(frames)) * 1e6
+    t_0 = time.perf_counter()
+    for i in range(n):
+        for f in frames:
+            modbus_crc(f)
+    dt2 = (time.perf_counter() - t_0) / (n * len(frames)) * 1e6
+    full = [f + modbus_checksum(f) for f in frames]
+    t_0 = time.perf_counter()
+    for i in range(n):
+        verify_frames(full)
+    dt3 = (time.perf_counter() - t_0) / (n * len(frames)) * 1e6
+    print('bitwise %6.2f us/frame, table %6.2f us/frame (x%4.1f), batch verify %6.2f us/frame' %
+          (dt1, dt2, dt1 / dt2, dt3))
+    print('Finished')
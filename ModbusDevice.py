@@ -2,7 +2,7 @@ import logging
 import os
 import sys
 import time
-from threading import Lock
+from threading import Lock, get_ident
 
 util_path = os.path.realpath('../TangoUtils')
 if util_path not in sys.path:
@@ -12,6 +12,12 @@ del util_path
 from ComPort import EmptyComPort, ComPort
 from config_logger import config_logger
 from log_exception import log_exception
+from DeviceMetrics import DeviceMetrics
+from DeviceRecovery import DeviceRecovery
+from AdaptiveTimeout import AdaptiveTimeout
+from ModbusCRC import modbus_checksum, verify_frame
+from PortBroker import BrokeredComPort
+from TCPPortPool import TCPPortPool
 
 ORGANIZATION_NAME = 'BINP'
 APPLICATION_NAME = 'Modbus Device sceleton module Python API'
@@ -19,19 +25,6 @@ APPLICATION_NAME_SHORT = 'ModbusDevice'
 APPLICATION_VERSION = '1.0'
 
 
-def modbus_crc(msg: bytes) -> int:
-    crc = 0xFFFF
-    for n in range(len(msg)):
-        crc ^= msg[n]
-        for i in range(8):
-            if crc & 1:
-                crc >>= 1
-                crc ^= 0xA001
-            else:
-                crc >>= 1
-    return crc
-
-
 class ModbusDevice:
     _devices = []
     _lock = Lock()
@@ -46,16 +39,28 @@ class ModbusDevice:
         self.suspend_to = 0.0
         self.port = str(port).strip()
         self.addr = int(addr)
+        # transaction latency and error counters
+        self.metrics = DeviceMetrics.get(self.port, self.addr)
         self.error = 0
         self.command = 0
         self.request = b''
         self.response = b''
         self.read_timeout = kwargs.get('read_timeout', ModbusDevice.READ_TIMEOUT)
+        # read timeout learned from device latency, read_timeout is the upper limit
+        self.timeouts = AdaptiveTimeout.get(self.port, self.addr, kwargs.get('min_timeout', AdaptiveTimeout.FLOOR),
+                                            self.read_timeout, kwargs.get('adaptive_timeout', False))
+        self.write_time = time.perf_counter()
         self.suspend_delay = kwargs.get('suspend_delay', ModbusDevice.SUSPEND_DELAY)
+        # re-create by DeviceRecovery worker when suspend expires, False - inline in ready
+        self.background_recovery = kwargs.get('background_recovery', False)
+        # PortBroker address, port is shared with other processes through the broker
+        self.broker = kwargs.get('broker', None)
+        # host:port ports use shared connection from TCPPortPool
+        self.tcp_pool = kwargs.get('tcp_pool', False)
         # logger
         self.logger = kwargs.get('logger', config_logger(level=logging.DEBUG))
         kwargs['logger'] = self.logger
-        self.logger.debug(f'Modbus device {self.id} creation started')
+        self.logger.debug('Modbus device %s creation started', self.id)
         # logs prefix
         self.pre = f'{self.id} at {self.port}: {self.addr} '
         # additional arguments for COM port creation
@@ -84,10 +89,11 @@ class ModbusDevice:
             return
         self.id = 'Modbus device'
         self.pre = f'{self.id} at {self.port}:{self.addr} '
-        self.debug(f'has been initialized')
+        self.debug('has been initialized')
         return
 
     def __del__(self):
+        DeviceRecovery.cancel(self)
         with ModbusDevice._lock:
             if self in ModbusDevice._devices:
                 self.close_com_port()
@@ -102,26 +108,38 @@ class ModbusDevice:
                 self.debug('has been removed from ModbusDevice._devices')
 
     def debug(self, msg, *args, **kwargs):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
         sl = kwargs.pop('stacklevel', 1)
         if sys.version_info.major >= 3 and sys.version_info.minor >= 8:
             kwargs['stacklevel'] = sl + 2
-        self.logger.debug(f'{self.pre} {msg}', *args, **kwargs)
+        self.logger.debug('%s ' + msg, self.pre, *args, **kwargs)
 
     def info(self, msg, *args, **kwargs):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
         sl = kwargs.pop('stacklevel', 1)
         if sys.version_info.major >= 3 and sys.version_info.minor >= 8:
             kwargs['stacklevel'] = sl + 2
-        self.logger.info(f'{self.pre} {msg}', *args, **kwargs)
+        self.logger.info('%s ' + msg, self.pre, *args, **kwargs)
 
     def warning(self, msg, *args, **kwargs):
+        if not self.logger.isEnabledFor(logging.WARNING):
+            return
         sl = kwargs.pop('stacklevel', 1)
         if sys.version_info.major >= 3 and sys.version_info.minor >= 8:
             kwargs['stacklevel'] = sl + 2
-        self.logger.warning(f'{self.pre} {msg}', *args, **kwargs)
+        self.logger.warning('%s ' + msg, self.pre, *args, **kwargs)
 
     def create_com_port(self):
         if 'baudrate' not in self.kwargs:
             self.kwargs['baudrate'] = 115200
+        if self.broker:
+            self.com = BrokeredComPort.get(self.port, self.broker, **self.kwargs)
+            return self.com
+        if self.tcp_pool and TCPPortPool.is_tcp(self.port):
+            self.com = TCPPortPool.get(self.port, **self.kwargs)
+            return self.com
         self.com = ComPort(self.port, emulated=EmptyComPort, **self.kwargs)
         return self.com
 
@@ -139,18 +157,18 @@ class ModbusDevice:
         if duration is None:
             duration = self.suspend_delay
         self.suspend_to = time.time() + duration
+        self.metrics.count('suspends')
         self.debug('suspended for %5.2f sec', duration)
 
     @staticmethod
     def checksum(cmd: bytes) -> bytes:
-        return modbus_crc(cmd).to_bytes(2, 'little')
+        return modbus_checksum(cmd)
 
     def add_checksum(self, cmd: bytes) -> bytes:
         return cmd + self.checksum(cmd)
 
     def verify_checksum(self, cmd: bytes) -> bool:
-        cs = self.checksum(cmd[:-2])
-        return cmd[-2:] == cs
+        return verify_frame(cmd)
 
     def write(self, cmd) -> bool:
         if not self.ready:
@@ -161,6 +179,7 @@ class ModbusDevice:
         if not isinstance(cmd, bytes):
             return False
         self.error = 0
+        self.write_time = time.perf_counter()
         self.com.reset_input_buffer()
         self.com.reset_output_buffer()
         self.com.read()
@@ -181,12 +200,16 @@ class ModbusDevice:
             return False
         self.error = 0
         self.response = b''
-        self.read_timeout = time.time() + self.READ_TIMEOUT
-        while time.time() < self.read_timeout and len(self.response) < 3:
+        name = f'FC{self.command}'
+        # read_timeout stays the configured limit of learned timeouts
+        deadline = time.time() + self.timeouts.timeout(name)
+        while time.time() < deadline and len(self.response) < 3:
             self.response += self.com.read(1000)
         # read timeout
-        if time.time() >= self.read_timeout:
+        if time.time() >= deadline:
             self.error = 259
+            self.metrics.count('timeouts')
+            self.timeouts.expired()
             self.suspend()
             return False
         # addr check
@@ -209,13 +232,18 @@ class ModbusDevice:
             # multi-byte operations
             k = int(self.response[2]) + extra_bytes
         # wait for next bytes
-        while time.time() < self.read_timeout and len(self.response) < k:
+        while time.time() < deadline and len(self.response) < k:
             self.response += self.com.read(1000)
-        if time.time() >= self.read_timeout:
+        if time.time() >= deadline:
             self.error = 259
+            self.metrics.count('timeouts')
+            self.timeouts.expired()
             self.suspend()
             return False
-        return self.check_response(self.response)
+        result = self.check_response(self.response)
+        if result:
+            self.timeouts.sample(name, time.perf_counter() - self.write_time)
+        return result
 
     def check_response(self, cmd: bytes) -> bool:
         self.error = 0
@@ -242,9 +270,10 @@ class ModbusDevice:
         msg += int.to_bytes(start, 2, byteorder='big')
         msg += int.to_bytes(length, 2, byteorder='big')
         data = []
-        if not self.write(msg):
-            return data
-        if not self.read():
+        t0 = time.perf_counter()
+        result = self.write(msg) and self.read()
+        self.metrics.record(f'FC{command}', time.perf_counter() - t0, result)
+        if not result:
             return data
         for i in range(length):
             data.append(int.from_bytes(self.response[2 * i + 3:2 * i + 5], byteorder='big'))
@@ -276,9 +305,10 @@ class ModbusDevice:
         msg += int.to_bytes(length // 2, 2, byteorder="big")
         msg += int.to_bytes(length, 1, byteorder='big')
         msg += out
-        if not self.write(msg):
-            return 0
-        if not self.read():
+        t0 = time.perf_counter()
+        result = self.write(msg) and self.read()
+        self.metrics.record(f'FC{command}', time.perf_counter() - t0, result)
+        if not result:
             return 0
         data = int.from_bytes(self.response[4:6], byteorder='big')
         return data
@@ -287,12 +317,39 @@ class ModbusDevice:
     def ready(self):
         if time.time() < self.suspend_to:
             return False
+        # during recover() the device is ready for the recovery thread only
+        recovery_thread = getattr(self, 'recovery_thread', None)
+        if recovery_thread is not None and recovery_thread != get_ident():
+            return False
         # was suspended try to init
         if self.suspend_to > 0.0:
+            if self.background_recovery:
+                # not ready until recovery worker succeeds, requests fail immediately meanwhile
+                self.suspend_to = float('inf')
+                DeviceRecovery.submit(self)
+                return False
             self.remove()
             self.__init__(self.port, self.addr, **self.kwargs)
+            self.restore()
         return self.suspend_to <= 0.0
 
+    def recover(self):
+        # executed by DeviceRecovery worker
+        self.recovery_thread = get_ident()
+        try:
+            self.remove()
+            self.__init__(self.port, self.addr, **self.kwargs)
+            result = self.suspend_to <= 0.0 and self.restore()
+        finally:
+            self.recovery_thread = None
+        if not result:
+            self.suspend_to = float('inf')
+        return result
+
+    def restore(self):
+        # replay saved device state after re-creation
+        return True
+
 
 def print_ints(arr, r, base=None):
     d = 3
@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
+
+import argparse
+import ipaddress
+import os
+import socket
+import tempfile
+import time
+from collections import deque
+from multiprocessing.connection import Client, Listener
+from threading import Condition, Lock, RLock, Thread
+
+from config_logger import config_logger
+from log_exception import log_exception
+from EmultedTDKLambdaAtComPort import EmultedTDKLambdaAtComPort
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'Serial port broker for several processes at one line'
+APPLICATION_NAME_SHORT = 'PortBroker'
+APPLICATION_VERSION = '1.0'
+
+# shared secret of the broker and its clients, connections are authenticated before any request is unpickled
+AUTHKEY_ENV = 'PORT_BROKER_AUTHKEY'
+# broker read waits up to READ_WAIT for the first byte, as serial port read timeout
+READ_WAIT = 0.01
+# session taken implicitly by read/write without lock is released after AUTO_RELEASE of client inactivity
+AUTO_RELEASE = 0.1
+# COM port parameters passed to the broker
+PORT_KWARGS = ('baudrate', 'bytesize', 'parity', 'stopbits', 'timeout', 'write_timeout')
+
+
+def broker_address(address=None):
+    # 'host:port' - TCP, other string - unix socket or windows pipe name, None - default one:
+    # socket in the private directory of the user
+    if not address:
+        if sys.platform.startswith('win'):
+            return r'\\.\pipe\PortBroker'
+        return os.path.join(tempfile.gettempdir(), f'PortBroker-{os.getuid()}', 'PortBroker.sock')
+    if isinstance(address, str) and ':' in address and not address.startswith('\\\\'):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address
+
+
+def broker_authkey(authkey=None):
+    # explicit key or PORT_BROKER_AUTHKEY environment variable, there is no default one
+    if not authkey:
+        authkey = os.environ.get(AUTHKEY_ENV, '')
+    if isinstance(authkey, str):
+        authkey = authkey.encode()
+    if not authkey:
+        raise BrokerError(f'{APPLICATION_NAME_SHORT} authkey is not set, define {AUTHKEY_ENV} environment variable')
+    return authkey
+
+
+def is_unix_socket(address):
+    return isinstance(address, str) and not address.startswith('\\\\')
+
+
+class PortOwner:
+    # Physical port at the broker. Clients get exclusive sessions in FIFO order,
+    # a client without explicit lock holds an implicit session until AUTO_RELEASE inactivity.
+    def __init__(self, port, kwargs, logger):
+        self.port = port
+        self.logger = logger
+        if port.upper().startswith('FAKE'):
+            # stand-in serial backend for local tests
+            self.device = EmultedTDKLambdaAtComPort(port)
+        else:
+            from ComPort import ComPort
+            self.device = ComPort(port, **kwargs)
+        self.condition = Condition()
+        self.queue = deque()
+        self.holder = None
+        self.explicit = False
+        self.last_client = None
+        self.last_op = 0.0
+        self.sessions = 0
+        self.foreign = 0
+
+    def acquire(self, client, explicit=False):
+        # returns True if other client used the port since the previous session of this client
+        with self.condition:
+            if self.holder is client:
+                self.explicit = self.explicit or explicit
+                self.last_op = time.perf_counter()
+                return False
+            self.queue.append(client)
+            try:
+                while self.holder is not None or self.queue[0] is not client:
+                    if (self.holder is not None and not self.explicit and
+                            time.perf_counter() - self.last_op > AUTO_RELEASE):
+                        # inactive implicit session
+                        self.holder = None
+                        self.condition.notify_all()
+                        continue
+                    self.condition.wait(AUTO_RELEASE)
+            finally:
+                self.queue.remove(client)
+            self.holder = client
+            self.explicit = explicit
+            self.last_op = time.perf_counter()
+            self.sessions += 1
+            foreign = self.last_client is not client
+            if foreign:
+                self.foreign += 1
+            self.last_client = client
+            return foreign
+
+    def release(self, client):
+        with self.condition:
+            if self.holder is client:
+                self.holder = None
+                self.explicit = False
+                self.condition.notify_all()
+
+    def read(self, size, wait):
+        t0 = time.perf_counter()
+        while True:
+            result = self.device.read(size)
+            if result or time.perf_counter() - t0 >= wait:
+                return result
+            time.sleep(0.0005)
+
+    def transact(self, data, terminator, size, timeout):
+        # framed transaction: write request, read response up to terminator or size bytes
+        self.device.reset_input_buffer()
+        self.device.write(data)
+        result = b''
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < timeout:
+            result += self.read(size - len(result) if size else 1024, READ_WAIT)
+            if (terminator and terminator in result) or (size and len(result) >= size):
+                break
+        return result
+
+    def execute(self, client, op, args):
+        if op == 'lock':
+            return None, self.acquire(client, True)
+        if op == 'unlock':
+            self.release(client)
+            return None, False
+        foreign = self.acquire(client)
+        try:
+            if op == 'write':
+                return self.device.write(args[0]), foreign
+            if op == 'read':
+                return self.read(*args), foreign
+            if op == 'reset_input':
+                return self.device.reset_input_buffer(), foreign
+            if op == 'reset_output':
+                if hasattr(self.device, 'reset_output_buffer'):
+                    return self.device.reset_output_buffer(), foreign
+                return True, foreign
+            if op == 'in_waiting':
+                return getattr(self.device, 'in_waiting', 0), foreign
+            if op == 'transact':
+                return self.transact(*args), foreign
+            raise ValueError(f'Unknown operation {op}')
+        finally:
+            self.last_op = time.perf_counter()
+            if op == 'transact' and not self.explicit:
+                self.release(client)
+
+
+class PortBroker:
+    # Owns physical ports and serves their sessions to client processes (BrokeredComPort),
+    # one thread per client connection
+    # TCP listener is accepted at loopback addresses only, unless allow_remote is True
+    def __init__(self, address=None, authkey=None, logger=None, allow_remote=False):
+        self.address = broker_address(address)
+        self.authkey = broker_authkey(authkey)
+        self.logger = logger if logger is not None else config_logger()
+        self.owners = {}
+        self.lock = Lock()
+        if isinstance(self.address, tuple) and not allow_remote and not self.is_loopback(self.address[0]):
+            raise BrokerError(f'{APPLICATION_NAME_SHORT} at {self.address} is reachable from network')
+        if is_unix_socket(self.address):
+            self.prepare_socket()
+        self.listener = Listener(self.address, authkey=self.authkey)
+        if is_unix_socket(self.address):
+            os.chmod(self.address, 0o600)
+        self.running = True
+
+    @staticmethod
+    def is_loopback(host):
+        try:
+            return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+        except (OSError, ValueError):
+            return False
+
+    def prepare_socket(self):
+        folder = os.path.dirname(self.address)
+        if folder == os.path.dirname(broker_address()):
+            # default private directory
+            os.makedirs(folder, mode=0o700, exist_ok=True)
+            st = os.stat(folder)
+            if st.st_uid != os.getuid() or st.st_mode & 0o077:
+                raise BrokerError(f'{folder} is not private directory of the user')
+        if not os.path.exists(self.address):
+            return
+        # socket of another live broker is not removed, stale one is
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.address)
+            raise BrokerError(f'Another {APPLICATION_NAME_SHORT} is listening at {self.address}')
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(self.address)
+        finally:
+            probe.close()
+
+    def owner(self, port, kwargs):
+        with self.lock:
+            if port not in self.owners:
+                self.owners[port] = PortOwner(port, kwargs, self.logger)
+                self.logger.info('Port %s opened %s', port, kwargs)
+            return self.owners[port]
+
+    def serve_forever(self):
+        self.logger.info('%s listening at %s', APPLICATION_NAME_SHORT, self.address)
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except KeyboardInterrupt:
+                raise
+            except:
+                if self.running:
+                    log_exception(self.logger, 'Connection accept error')
+                continue
+            Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def serve(self, conn):
+        client = object()
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    break
+                try:
+                    op, port, *args = request
+                    if op == 'open':
+                        owner = self.owner(port, args[0])
+                        reply = ('ok', True, True)
+                    elif op == 'close':
+                        owner = self.owners.get(port)
+                        if owner is not None:
+                            owner.release(client)
+                        reply = ('ok', True, False)
+                    else:
+                        result, foreign = self.owners[port].execute(client, op, args)
+                        reply = ('ok', result, foreign)
+                except KeyboardInterrupt:
+                    raise
+                except Exception as ex:
+                    log_exception(self.logger, f'Request {request[:2]} error')
+                    reply = ('error', str(ex), True)
+                conn.send(reply)
+        finally:
+            # client disconnected, free its sessions
+            with self.lock:
+                owners = list(self.owners.values())
+            for owner in owners:
+                owner.release(client)
+            conn.close()
+
+    def stop(self):
+        self.running = False
+        self.listener.close()
+
+    def stats(self):
+        with self.lock:
+            return {p: {'sessions': o.sessions, 'foreign': o.foreign, 'waiting': len(o.queue)}
+                    for p, o in self.owners.items()}
+
+
+class BrokerLock:
+    # com.lock of BrokeredComPort: in process RLock plus broker session for the outermost acquisition
+    def __init__(self, com):
+        self.com = com
+        self.local = RLock()
+        self.depth = 0
+
+    def acquire(self, blocking=True, timeout=-1):
+        if not self.local.acquire(blocking, timeout):
+            return False
+        self.depth += 1
+        if self.depth == 1:
+            try:
+                self.com.request('lock')
+            except:
+                self.depth -= 1
+                self.local.release()
+                raise
+        return True
+
+    def release(self):
+        self.depth -= 1
+        try:
+            if self.depth == 0:
+                self.com.request('unlock')
+        finally:
+            self.local.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class BrokerError(Exception):
+    pass
+
+
+class BrokeredComPort:
+    # ComPort interface to the port owned by PortBroker process. One object per port and broker in process.
+    # When other process used the port since our previous session, current bus address is forgotten
+    # and input is marked dirty, as stray bytes may be pending.
+    _ports = {}
+    _lock = Lock()
+
+    def __init__(self, port, address=None, authkey=None, **kwargs):
+        self.port = str(port).strip()
+        self.address = broker_address(address)
+        self.authkey = authkey
+        self.kwargs = {k: kwargs[k] for k in PORT_KWARGS if k in kwargs}
+        self.logger = kwargs.get('logger', config_logger())
+        self.device = BrokeredComPort
+        self.lock = BrokerLock(self)
+        self.conn_lock = Lock()
+        self.conn = None
+        self.users = 0
+        self.ready = False
+        self.open()
+
+    @staticmethod
+    def get(port, address=None, **kwargs):
+        key = (str(port).strip(), broker_address(address))
+        with BrokeredComPort._lock:
+            com = BrokeredComPort._ports.get(key)
+            if com is None:
+                com = BrokeredComPort(port, address, **kwargs)
+                BrokeredComPort._ports[key] = com
+            elif not com.ready:
+                com.open()
+            com.users += 1
+            return com
+
+    def open(self):
+        try:
+            with self.conn_lock:
+                if self.conn is None:
+                    self.conn = Client(self.address, authkey=broker_authkey(self.authkey))
+                self.conn.send(('open', self.port, self.kwargs))
+                self.ready = self.conn.recv()[0] == 'ok'
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'Can not connect to {APPLICATION_NAME_SHORT} at {self.address}')
+            self.conn = None
+            self.ready = False
+        return self.ready
+
+    def request(self, op, *args):
+        with self.conn_lock:
+            if self.conn is None:
+                raise BrokerError(f'{self.port} is not connected to {APPLICATION_NAME_SHORT}')
+            try:
+                self.conn.send((op, self.port) + args)
+                status, result, foreign = self.conn.recv()
+            except (EOFError, OSError):
+                # broker is gone, next get() reconnects
+                self.conn = None
+                self.ready = False
+                raise
+        if foreign:
+            self.current_addr = -1
+            self.input_dirty = True
+        if status != 'ok':
+            raise BrokerError(result)
+        return result
+
+    def read(self, size=1, timeout=None):
+        return self.request('read', size, READ_WAIT)
+
+    def write(self, data, timeout=None):
+        return self.request('write', bytes(data))
+
+    def reset_input_buffer(self, timeout=None):
+        result = self.request('reset_input')
+        if hasattr(self, 'read_buffer'):
+            self.read_buffer.clear()
+        return result
+
+    def reset_output_buffer(self, timeout=None):
+        return self.request('reset_output')
+
+    @property
+    def in_waiting(self):
+        return self.request('in_waiting')
+
+    def transact(self, data, terminator=b'\r', size=None, timeout=1.0):
+        # complete request/response transaction in one broker call
+        return self.request('transact', bytes(data), terminator, size, timeout)
+
+    def close(self):
+        with BrokeredComPort._lock:
+            self.users -= 1
+            if self.users > 0:
+                return True
+            BrokeredComPort._ports.pop((self.port, self.address), None)
+        try:
+            with self.conn_lock:
+                if self.conn is not None:
+                    self.conn.send(('close', self.port))
+                    self.conn.recv()
+                    self.conn.close()
+        except KeyboardInterrupt:
+            raise
+        except:
+            pass
+        self.conn = None
+        self.ready = False
+        return True
+
+
+def client_process(port, addresses, address, duration, queue):
+    # demo client: TDKLambda devices at the shared port, counts failed operations
+    from TDKLambda import TDKLambda
+    devices = [TDKLambda(port, a, broker=address, identity_cache=False, background_recovery=False)
+               for a in addresses]
+    n = 0
+    errors = 0
+    t0 = time.time()
+    while time.time() - t0 < duration:
+        for d in devices:
+            v = round(d.addr + n % 10 * 0.1, 2)
+            if not d.write_voltage(v) or d.read_programmed_voltage() != v:
+                errors += 1
+            n += 1
+    queue.put((addresses, n, errors))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=APPLICATION_NAME)
+    parser.add_argument('--address', default='', help='host:port, unix socket or pipe name')
+    parser.add_argument('--demo', type=int, default=0, help='run broker with N client processes at FAKECOM port')
+    parser.add_argument('--duration', type=float, default=5.0, help='demo duration, s')
+    parser.add_argument('--allow-remote', action='store_true', help='accept TCP address reachable from network')
+    args = parser.parse_args()
+
+    if args.demo and not os.environ.get(AUTHKEY_ENV):
+        # one time key, inherited by demo client processes
+        os.environ[AUTHKEY_ENV] = os.urandom(16).hex()
+    try:
+        broker = PortBroker(args.address or None, allow_remote=args.allow_remote)
+    except BrokerError as ex:
+        print(ex)
+        sys.exit(1)
+    if not args.demo:
+        broker.serve_forever()
+    else:
+        from multiprocessing import Process, Queue
+        Thread(target=broker.serve_forever, daemon=True).start()
+        q = Queue()
+        address = args.address or broker.address
+        clients = [Process(target=client_process, args=('FAKECOM50', [2 * i + 1, 2 * i + 2], address,
+                                                         args.duration, q)) for i in range(args.demo)]
+        for c in clients:
+            c.start()
+        for c in clients:
+            addresses, n, errors = q.get()
+            print('addresses %s: %d operations %d errors' % (addresses, n, errors))
+        for c in clients:
+            c.join()
+        print(broker.stats())
+        broker.stop()
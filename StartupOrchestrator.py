@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock
+
+from config_logger import config_logger
+from log_exception import log_exception
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'Parallel device initialization at server startup'
+APPLICATION_NAME_SHORT = 'StartupOrchestrator'
+APPLICATION_VERSION = '1.0'
+
+
+class StartupOrchestrator:
+    # Device initializations are executed by one worker thread per port:
+    # devices at different ports are initialized in parallel, devices at the same bus one by one.
+    _executors = {}
+    _futures = {}
+    _lock = Lock()
+    timing = {}
+    logger = None
+
+    @staticmethod
+    def submit(name, port, func, *args, callback=None, **kwargs):
+        # func(*args, **kwargs) initializes the device, callback(result) completes it at the same port thread
+        if StartupOrchestrator.logger is None:
+            StartupOrchestrator.logger = config_logger()
+        port = str(port).strip()
+        with StartupOrchestrator._lock:
+            if port not in StartupOrchestrator._executors:
+                StartupOrchestrator._executors[port] = ThreadPoolExecutor(max_workers=1,
+                                                                          thread_name_prefix=f'Init {port}')
+            future = StartupOrchestrator._executors[port].submit(StartupOrchestrator._run, name, port,
+                                                                 func, args, kwargs, callback)
+            StartupOrchestrator._futures[name] = future
+        return future
+
+    @staticmethod
+    def _run(name, port, func, args, kwargs, callback):
+        t0 = time.perf_counter()
+        result = None
+        try:
+            result = func(*args, **kwargs)
+            if callback is not None:
+                callback(result)
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(StartupOrchestrator.logger, f'{name} at {port} initialization error')
+        dt = time.perf_counter() - t0
+        StartupOrchestrator.timing[name] = dt
+        StartupOrchestrator.logger.info(f'{name} at {port} initialized in %6.3f s', dt)
+        return result
+
+    @staticmethod
+    def wait_all(timeout=None):
+        # wait for all submitted initializations, returns {name: init time in seconds}
+        with StartupOrchestrator._lock:
+            futures = list(StartupOrchestrator._futures.values())
+        t0 = time.perf_counter()
+        wait(futures, timeout)
+        if futures and StartupOrchestrator.logger is not None:
+            StartupOrchestrator.logger.info('%d devices initialized in %6.3f s (sum of device times %6.3f s)',
+                                            len(futures), time.perf_counter() - t0,
+                                            sum(StartupOrchestrator.timing.values()))
+        return dict(StartupOrchestrator.timing)
+
+    @staticmethod
+    def shutdown():
+        with StartupOrchestrator._lock:
+            for ex in StartupOrchestrator._executors.values():
+                ex.shutdown(wait=False)
+            StartupOrchestrator._executors.clear()
+            StartupOrchestrator._futures.clear()
+
+
+if __name__ == "__main__":
+    from TDKLambda import TDKLambda
+
+    devices = [TDKLambda(f'FAKECOM{p}', a, defer_init=True) for p in range(1, 5) for a in range(1, 4)]
+    t_0 = time.time()
+    for d in devices:
+        StartupOrchestrator.submit(f'{d.port}:{d.addr}', d.port, d.init)
+    timing = StartupOrchestrator.wait_all()
+    dt = time.time() - t_0
+    for name in timing:
+        print(name, '%6.3f s' % timing[name])
+    print(len(devices), 'devices at 4 ports initialized in %6.3f s, serial time %6.3f s' %
+          (dt, sum(timing.values())))
+    StartupOrchestrator.shutdown()
+    print('Finished')
@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
+
+import re
+import select
+import socket
+import time
+from threading import Lock, RLock, Thread
+
+from config_logger import config_logger
+from log_exception import log_exception
+
+ORGANIZATION_NAME = 'BINP'
+APPLICATION_NAME = 'Shared TCP connections to serial device servers'
+APPLICATION_NAME_SHORT = 'TCPPortPool'
+APPLICATION_VERSION = '1.0'
+
+# raw TCP port of Moxa NPort serial servers
+DEFAULT_TCP_PORT = 4001
+TCP_ADDRESS = re.compile(r'^(\d{1,3}(?:\.\d{1,3}){3})(?::(\d+))?$|^([A-Za-z][\w.-]*):(\d+)$')
+
+
+class TCPPort:
+    # ComPort interface over one TCP connection, shared by all drivers in the process.
+    # Broken connection is closed by the first failed operation and reopened once by the next one,
+    # failed connects are repeated not earlier than BACKOFF * 2**failures (up to MAX_BACKOFF) s later.
+    CONNECT_TIMEOUT = 2.0
+    READ_WAIT = 0.01
+    BACKOFF = 0.5
+    MAX_BACKOFF = 30.0
+    # TCP keep-alive: idle time before probes, probe interval, number of probes
+    KEEPALIVE = (10, 5, 3)
+
+    def __init__(self, host, port, logger=None):
+        self.host = host
+        self.tcp_port = port
+        self.port = f'{host}:{port}'
+        self.logger = logger if logger is not None else config_logger()
+        self.device = TCPPort
+        self.lock = RLock()
+        self.conn_lock = Lock()
+        self.sock = None
+        self.users = 0
+        self.last_io = 0.0
+        self.released = 0.0
+        self.next_connect = 0.0
+        self.failures = 0
+        self.connects = 0
+        self.disconnects = 0
+
+    @property
+    def ready(self):
+        return self.sock is not None or self.connect()
+
+    def connect(self):
+        with self.conn_lock:
+            if self.sock is not None:
+                return True
+            if time.time() < self.next_connect:
+                return False
+            try:
+                sock = socket.create_connection((self.host, self.tcp_port), self.CONNECT_TIMEOUT)
+                self.keepalive(sock)
+                sock.settimeout(self.READ_WAIT)
+                self.sock = sock
+                self.connects += 1
+                self.failures = 0
+                self.next_connect = 0.0
+                self.last_io = time.time()
+                # new connection, device state at the line is unknown
+                self.current_addr = -1
+                self.input_dirty = True
+                self.logger.info('%s connected (%d)', self.port, self.connects)
+                return True
+            except KeyboardInterrupt:
+                raise
+            except:
+                self.next_connect = time.time() + min(self.BACKOFF * 2 ** self.failures, self.MAX_BACKOFF)
+                self.failures += 1
+                self.logger.info('%s connection error, next attempt in %5.2f s', self.port,
+                                 self.next_connect - time.time())
+                return False
+
+    def keepalive(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        idle, interval, count = self.KEEPALIVE
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+        elif hasattr(socket, 'SIO_KEEPALIVE_VALS'):
+            sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+
+    def disconnect(self, sock=None):
+        # close the connection if it is still the one that failed
+        with self.conn_lock:
+            if self.sock is None or (sock is not None and sock is not self.sock):
+                return
+            try:
+                self.sock.close()
+            except KeyboardInterrupt:
+                raise
+            except:
+                pass
+            self.sock = None
+            self.disconnects += 1
+            self.current_addr = -1
+            self.input_dirty = True
+
+    def alive(self):
+        # health check of idle connection: readable socket with no data is closed by peer
+        sock = self.sock
+        if sock is None:
+            return False
+        try:
+            r, w, e = select.select([sock], [], [], 0)
+            if r and sock.recv(1, socket.MSG_PEEK) == b'':
+                self.disconnect(sock)
+                return False
+            return True
+        except KeyboardInterrupt:
+            raise
+        except:
+            self.disconnect(sock)
+            return False
+
+    def read(self, size=1, timeout=None):
+        if self.sock is None and not self.connect():
+            return b''
+        sock = self.sock
+        try:
+            result = sock.recv(size)
+            if not result:
+                # closed by peer
+                self.disconnect(sock)
+            self.last_io = time.time()
+            return result
+        except socket.timeout:
+            return b''
+        except KeyboardInterrupt:
+            raise
+        except:
+            self.disconnect(sock)
+            return b''
+
+    def write(self, data, timeout=None):
+        if self.sock is None and not self.connect():
+            return 0
+        sock = self.sock
+        try:
+            sock.sendall(data)
+            self.last_io = time.time()
+            return len(data)
+        except KeyboardInterrupt:
+            raise
+        except:
+            self.disconnect(sock)
+            return 0
+
+    def reset_input_buffer(self, timeout=None):
+        if self.sock is None and not self.connect():
+            return False
+        sock = self.sock
+        try:
+            while select.select([sock], [], [], 0)[0]:
+                if not sock.recv(4096):
+                    self.disconnect(sock)
+                    return False
+            return True
+        except KeyboardInterrupt:
+            raise
+        except:
+            self.disconnect(sock)
+            return False
+
+    def reset_output_buffer(self, timeout=None):
+        return self.sock is not None
+
+    @property
+    def in_waiting(self):
+        sock = self.sock
+        if sock is None:
+            return 0
+        try:
+            return len(sock.recv(4096, socket.MSG_PEEK)) if select.select([sock], [], [], 0)[0] else 0
+        except KeyboardInterrupt:
+            raise
+        except:
+            return 0
+
+    def close(self):
+        # connection stays in the pool for TCPPortPool.LINGER s, device re-creation reuses it
+        with TCPPortPool._lock:
+            self.users = max(0, self.users - 1)
+            if self.users == 0:
+                self.released = time.time()
+        return True
+
+    def as_dict(self):
+        return {'port': self.port, 'connected': self.sock is not None, 'users': self.users,
+                'connects': self.connects, 'disconnects': self.disconnects, 'failures': self.failures}
+
+
+class TCPPortPool:
+    # Process wide TCP connections keyed by host:port. Health thread checks idle connections
+    # every HEALTH_PERIOD s, reopens broken ones in use and closes unused ones after LINGER s.
+    _ports = {}
+    _lock = Lock()
+    _thread = None
+    HEALTH_PERIOD = 5.0
+    LINGER = 60.0
+    logger = None
+
+    @staticmethod
+    def is_tcp(port):
+        return TCP_ADDRESS.match(str(port).strip()) is not None
+
+    @staticmethod
+    def address(port):
+        m = TCP_ADDRESS.match(str(port).strip())
+        if m is None:
+            raise ValueError(f'{port} is not a TCP address')
+        if m.group(1):
+            return m.group(1), int(m.group(2) or DEFAULT_TCP_PORT)
+        return m.group(3), int(m.group(4))
+
+    @staticmethod
+    def get(port, **kwargs):
+        host, tcp_port = TCPPortPool.address(port)
+        key = f'{host}:{tcp_port}'
+        if TCPPortPool.logger is None:
+            TCPPortPool.logger = kwargs.get('logger', config_logger())
+        with TCPPortPool._lock:
+            com = TCPPortPool._ports.get(key)
+            if com is None:
+                com = TCPPort(host, tcp_port, kwargs.get('logger'))
+                TCPPortPool._ports[key] = com
+            com.users += 1
+            if TCPPortPool._thread is None:
+                TCPPortPool._thread = Thread(target=TCPPortPool.run, daemon=True, name=APPLICATION_NAME_SHORT)
+                TCPPortPool._thread.start()
+        com.connect()
+        return com
+
+    @staticmethod
+    def check():
+        t = time.time()
+        with TCPPortPool._lock:
+            ports = list(TCPPortPool._ports.items())
+        for key, com in ports:
+            if com.users <= 0:
+                if t - com.released > TCPPortPool.LINGER:
+                    with TCPPortPool._lock:
+                        if com.users <= 0:
+                            TCPPortPool._ports.pop(key, None)
+                            com.disconnect()
+                continue
+            # busy connections are checked by their own I/O, the bus lock is not taken here
+            if t - com.last_io > TCPPortPool.HEALTH_PERIOD and not com.alive():
+                com.connect()
+
+    @staticmethod
+    def run():
+        while True:
+            time.sleep(TCPPortPool.HEALTH_PERIOD)
+            try:
+                TCPPortPool.check()
+            except KeyboardInterrupt:
+                raise
+            except:
+                log_exception(TCPPortPool.logger, 'Health check error')
+
+    @staticmethod
+    def stats():
+        with TCPPortPool._lock:
+            return {key: com.as_dict() for key, com in TCPPortPool._ports.items()}
+
+
+if __name__ == "__main__":
+    from EmultedTDKLambdaAtComPort import EmultedTDKLambdaAtComPort
+    from TDKLambda import TDKLambda
+
+    # TCP serial server stand-in with emulated TDK Lambda chain
+    emulator = EmultedTDKLambdaAtComPort('FAKETCP')
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    clients = []
+
+    def serve(conn):
+        conn.settimeout(0.005)
+        while True:
+            try:
+                data = conn.recv(1024)
+                if not data:
+                    return
+                emulator.write(data)
+            except socket.timeout:
+                pass
+            except OSError:
+                return
+            r = emulator.read(1024)
+            if r:
+                try:
+                    conn.sendall(r)
+                except OSError:
+                    return
+
+    def accept():
+        while True:
+            conn, a = server.accept()
+            clients.append(conn)
+            Thread(target=serve, args=(conn,), daemon=True).start()
+
+    Thread(target=accept, daemon=True).start()
+    address = '127.0.0.1:%d' % server.getsockname()[1]
+    devices = [TDKLambda(address, a, tcp_pool=True, identity_cache=False, suspend_delay=0.5) for a in range(1, 6)]
+    print([d.read_all()[0] for d in devices])
+    # network blip: serial server drops all connections
+    for c in clients:
+        c.close()
+    t_0 = time.time()
+    while time.time() - t_0 < 10.0:
+        values = [d.read_all()[0] for d in devices]
+        if all(v == v for v in values):
+            break
+        time.sleep(0.1)
+    print('recovered in %5.2f s' % (time.time() - t_0), values)
+    # drivers use the pool of imported module, not of __main__
+    import TCPPortPool as pool
+    print(pool.TCPPortPool.stats())
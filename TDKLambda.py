@@ -4,13 +4,22 @@ import sys
 if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
 if '../IT6900' not in sys.path: sys.path.append('../IT6900')
 
+import logging
 import time
-from threading import Lock
+from threading import Lock, get_ident
 
 from serial import SerialTimeoutException
+from BusScheduler import BusScheduler, READ_PRIORITY, WRITE_PRIORITY
 from ComPort import ComPort
+from AdaptiveTimeout import AdaptiveTimeout
+from DeviceMetrics import DeviceMetrics, command_name
+from DeviceRecovery import DeviceRecovery
 from EmultedTDKLambdaAtComPort import EmultedTDKLambdaAtComPort
+from GenParser import NAN_DVC, parse_dvc, parse_frame
+from IdentityCache import IdentityCache
 from IT6900 import IT6900
+from PortBroker import BrokeredComPort
+from TCPPortPool import TCPPortPool
 from config_logger import config_logger
 from log_exception import log_exception
 
@@ -31,6 +40,10 @@ class TDKLambda:
     _devices = []
     _lock = Lock()
     SUSPEND_DELAY = 5.0
+    READ_CHUNK = 1024
+    # pause between empty reads while waiting for response, s
+    READ_POLL = 0.001
+    LOG_SUMMARY_PERIOD = 60.0
     STATES = {
         1: 'Initialized',
         0: 'Pre init state',
@@ -50,8 +63,33 @@ class TDKLambda:
         self.read_timeout = kwargs.pop('read_timeout', 1.0)
         self.read_retries = kwargs.pop('read_retries', 2)
         self.suspend_delay = kwargs.pop('suspend_delay', TDKLambda.SUSPEND_DELAY)
+        # init() will be called later, e.g. by StartupOrchestrator
+        self.defer_init = kwargs.pop('defer_init', False)
+        # use on-disk identity cache to skip re-probing
+        self.identity_cache = kwargs.pop('identity_cache', False)
+        # re-probe by DeviceRecovery worker when suspend expires, False - inline init() in ready
+        self.background_recovery = kwargs.pop('background_recovery', False)
+        # PortBroker address, port is shared with other processes through the broker
+        self.broker = kwargs.pop('broker', None)
+        # host:port ports use shared connection from TCPPortPool
+        self.tcp_pool = kwargs.pop('tcp_pool', False)
+        # queue bus requests of all devices at the port to BusScheduler (writes first, fewer ADR switches)
+        self.bus_scheduler = kwargs.pop('bus_scheduler', False)
+        # thread executing recover(), other threads see the device not ready until it finishes
+        self.recovery_thread = None
+        # transaction latency and error counters
+        self.metrics = DeviceMetrics.get(self.port, self.addr)
+        # read timeout learned from device latency, read_timeout is the upper limit
+        self.timeouts = AdaptiveTimeout.get(self.port, self.addr, kwargs.pop('min_timeout', AdaptiveTimeout.FLOOR),
+                                            self.read_timeout, kwargs.pop('adaptive_timeout', False))
+        # timeout of the current transaction
+        self.timeout = self.read_timeout
         # configure logger
         self.logger = kwargs.get('logger', config_logger())
+        # quiet mode: one summary line per LOG_SUMMARY_PERIOD instead of one line per transaction
+        self.quiet = kwargs.pop('quiet', False)
+        self.log_summary_time = time.time()
+        self.log_summary_counters, self.log_summary_latency, self.log_summary_start = self.summary_totals()
         # arguments for COM port creation
         self.kwargs = kwargs
         # create variables
@@ -70,12 +108,17 @@ class TDKLambda:
         self.pre = f'{self.id} at {self.port}: {self.addr} '
         # create COM port
         self.create_com_port()
+        self.scheduler = BusScheduler.for_port(self.com, self.logger) if self.bus_scheduler else None
         # add device to list
         with TDKLambda._lock:
             if self not in TDKLambda._devices:
                 TDKLambda._devices.append(self)
         # further initialization (for possible async use)
-        self.init()
+        if self.defer_init:
+            # not ready until init() is called
+            self.suspend_to = float('inf')
+        else:
+            self.init()
 
     def init(self):
         self.state = 0
@@ -109,8 +152,12 @@ class TDKLambda:
             return False
         # read device serial number
         self.sn = self.read_serial_number()
-        # read device type
-        self.id = self.read_device_id()
+        # read device type, cached one is valid if serial number is the same
+        cached = self.cached_identity()
+        if cached is not None and self.sn and cached.get('sn') == self.sn:
+            self.id = cached.get('id', 'Unknown Device')
+        else:
+            self.id = self.read_device_id()
         self.pre = f'{self.id} {self.port}: {self.addr} '
         if 'LAMBDA' in self.id:
             self.state = 1
@@ -128,11 +175,27 @@ class TDKLambda:
             self.logger.warning(f'{self.pre} ' + self.STATES[self.state])
             self.suspend()
             return False
+        self.save_identity(sn=self.sn, id=self.id)
         msg = f'{self.pre} has been initialized'
         self.logger.info(msg)
         return True
 
+    def cached_identity(self):
+        if not self.identity_cache:
+            return None
+        return IdentityCache.get(self.port, self.addr, self.__class__.__name__)
+
+    def save_identity(self, **identity):
+        if self.identity_cache:
+            IdentityCache.put(self.port, self.addr, self.__class__.__name__, **identity)
+
+    def invalidate_identity(self):
+        # next init() runs the full probe
+        if self.identity_cache:
+            IdentityCache.invalidate(self.port, self.addr)
+
     def __del__(self):
+        DeviceRecovery.cancel(self)
         with TDKLambda._lock:
             if self in TDKLambda._devices:
                 self.close_com_port()
@@ -140,6 +203,12 @@ class TDKLambda:
                 self.logger.debug(f'{self.pre} has been deleted')
 
     def create_com_port(self):
+        if self.broker:
+            self.com = BrokeredComPort.get(self.port, self.broker, **self.kwargs)
+            return self.com
+        if self.tcp_pool and TCPPortPool.is_tcp(self.port):
+            self.com = TCPPortPool.get(self.port, **self.kwargs)
+            return self.com
         self.com = ComPort(self.port, emulated=EmultedTDKLambdaAtComPort, **self.kwargs)
         return self.com
 
@@ -165,118 +234,219 @@ class TDKLambda:
         if duration is None:
             duration = self.suspend_delay
         self.suspend_to = time.time() + duration
-        self.logger.debug(f'{self.pre} suspended for %5.2f sec', duration)
+        self.metrics.count('suspends')
+        self.logger.debug('%s suspended for %5.2f sec', self.pre, duration)
 
     @property
     def ready(self):
         if time.time() < self.suspend_to:
             # self.logger.debug(f'{self.pre} Suspended')
             return False
+        if self.recovery_thread is not None and self.recovery_thread != get_ident():
+            return False
         if self.suspend_to <= 0.0:
             return True
         # was suspended and expires
         # self.close_com_port()
         # self.create_com_port()
+        if self.background_recovery:
+            # not ready until recovery worker succeeds, requests fail immediately meanwhile
+            self.suspend_to = float('inf')
+            DeviceRecovery.submit(self)
+            return False
         val = self.init()
         return val
 
-    def _read(self, size=1, timeout=1.0):
-        result = b''
+    def recover(self):
+        # executed by DeviceRecovery worker
+        self.recovery_thread = get_ident()
+        try:
+            result = self.init() and self.restore()
+        finally:
+            self.recovery_thread = None
+        if not result:
+            self.suspend_to = float('inf')
+        return result
+
+    def restore(self):
+        # replay saved device state after recovery, GEN power supplies keep their settings
+        return True
+
+    @property
+    def read_buffer(self):
+        # bytes received from the port but not consumed yet (shared by all devices on the port)
+        if not hasattr(self.com, 'read_buffer'):
+            self.com.read_buffer = bytearray()
+        return self.com.read_buffer
+
+    @property
+    def input_dirty(self):
+        # stray bytes may be pending at the port (shared by all devices on the port), unknown state is dirty
+        return getattr(self.com, 'input_dirty', True)
+
+    @input_dirty.setter
+    def input_dirty(self, value):
+        self.com.input_dirty = value
+
+    @staticmethod
+    def _terminators(terminator):
+        # bytes terminator means any of its bytes, tuple or list means any of its items
+        if isinstance(terminator, (bytes, bytearray)):
+            return [terminator[i:i + 1] for i in range(len(terminator))]
+        return terminator
+
+    @staticmethod
+    def _find_terminator(buffer, terminators, start=0):
+        # return end position of the first terminator found at or after start, or -1
+        end = -1
+        for t in terminators:
+            i = buffer.find(t, max(0, start - len(t) + 1))
+            if i >= 0 and (end < 0 or i + len(t) < end):
+                end = i + len(t)
+        return end
+
+    def _fill_buffer(self, timeout=1.0):
+        # read all available bytes in one call, wait for at least one byte until timeout
         t0 = time.perf_counter()
-        while len(result) < size:
-            r = self.com.read(1)
+        while True:
+            r = self.com.read(self.READ_CHUNK)
             if r:
-                result += r
+                self.read_buffer.extend(r)
+                return len(r)
+            dt = time.perf_counter() - t0
+            if timeout is not None and dt > timeout:
+                raise SerialTimeoutException(f'{self.pre} Reading timeout {bytes(self.read_buffer)}')
+            # yield CPU instead of busy polling the port
+            if timeout is None:
+                time.sleep(self.READ_POLL)
+            else:
+                time.sleep(min(self.READ_POLL, max(0.0, timeout - dt)))
+
+    def _read(self, size=1, timeout=1.0):
+        buffer = self.read_buffer
+        t0 = time.perf_counter()
+        while len(buffer) < size:
+            if timeout is None:
+                self._fill_buffer(None)
             else:
-                if timeout is not None and time.perf_counter() - t0 > timeout:
-                    raise SerialTimeoutException(f'{self.pre} Reading timeout {result}')
+                self._fill_buffer(max(0.0, timeout - (time.perf_counter() - t0)))
+        result = bytes(buffer[:size])
+        del buffer[:size]
         return result
 
     def read(self, size=1):
         result = b''
         try:
-            result = self._read(size, self.read_timeout)
+            result = self._read(size, self.timeout)
             return result
         except KeyboardInterrupt:
             raise
         except SerialTimeoutException:
-            self.logger.info(f'{self.pre} Reading timeout')
+            self.input_dirty = True
+            self.metrics.count('timeouts')
+            self.timeouts.expired()
+            self.logger.info('%s Reading timeout', self.pre)
             return result
         except:
+            self.input_dirty = True
             log_exception(self.logger, f'{self.pre} Reading exception')
             return b''
 
     def read_until(self, terminator=CR, size=None):
-        result = b''
-        # t0 = time.perf_counter()
-        while not any([i in result for i in terminator]):
-            r = self.read(1)
-            if not r:
-                break
-            result += r
-            if size is not None and len(result) >= size:
-                break
-            # if time.perf_counter() - t0 > self.read_timeout:
-            #     self.suspend()
-            #     break
-        # dt = (time.perf_counter() - t0) * 1000.0
-        # self.logger.debug('%s %s bytes in %4.0f ms', result, len(result), dt)
+        terminators = self._terminators(terminator)
+        buffer = self.read_buffer
+        scanned = 0
+        t0 = time.perf_counter()
+        try:
+            while True:
+                # search only the bytes appended since the previous pass
+                end = self._find_terminator(buffer, terminators, scanned)
+                if size is not None and (end < 0 or end > size) and len(buffer) >= size:
+                    end = size
+                if end >= 0:
+                    break
+                scanned = len(buffer)
+                self._fill_buffer(max(0.0, self.timeout - (time.perf_counter() - t0)))
+        except KeyboardInterrupt:
+            raise
+        except SerialTimeoutException:
+            self.input_dirty = True
+            self.metrics.count('timeouts')
+            self.timeouts.expired()
+            self.logger.info('%s Reading timeout', self.pre)
+            end = len(buffer)
+        except:
+            self.input_dirty = True
+            log_exception(self.logger, f'{self.pre} Reading exception')
+            end = len(buffer)
+        # leftover bytes stay in the buffer for the next read
+        result = bytes(buffer[:end])
+        del buffer[:end]
         return result
 
     def read_response(self, terminator=CR):
         result = self.read_until(terminator)
         self.response = result
-        if not any([i in result for i in terminator]):
-            self.logger.debug(f'{self.pre} Response %s without %s', result, terminator)
+        if self._find_terminator(result, self._terminators(terminator)) < 0:
+            self.input_dirty = True
+            self.logger.debug('%s Response %s without %s', self.pre, result, terminator)
+            return False
+        # checksum calculation, it may read the rest of the frame (checksum byte, LF ...)
+        if not self.verify_checksum(result):
+            self.input_dirty = True
             return False
-        # checksum calculation
-        return self.verify_checksum(result)
+        # bytes after the complete response, reset input before the next command
+        if self.read_buffer:
+            self.input_dirty = True
+        return True
 
     def verify_checksum(self, result):
         if not self.check:
             return True
-        m = result.find(b'$')
-        if m < 0:
-            self.logger.debug(f'{self.pre} No expected checksum in response')
+        payload = parse_frame(result, True)
+        if payload is None:
+            self.logger.debug('%s No or incorrect checksum in response %s', self.pre, result)
             return False
-        else:
-            cs = self.checksum(result[:m])
-            if result[m + 1:] != cs:
-                self.logger.debug(f'{self.pre} Incorrect checksum in response')
-                return False
-            self.response = result[:m]
-            return True
+        # response without checksum, but with CR as without checksum mode
+        self.response = result[:len(payload)] + result[-1:]
+        return True
 
     def check_response(self, expected=b'OK', response=None):
         if response is None:
             response = self.response
         if response.startswith(expected):
             return True
-        msg = f'{self.pre} Unexpected response %s (not %s)' % (response, expected)
-        self.logger.debug(msg)
+        self.logger.debug('%s Unexpected response %s (not %s)', self.pre, response, expected)
         return False
 
-    def write(self, cmd):
+    def write(self, cmd, reset=True):
         # t0 = time.perf_counter()
         try:
-            # reset input buffer
-            if not self.com.reset_input_buffer():
-                return False
+            # reset input buffer only if stray bytes may be pending (after timeout, garbled response ...)
+            if reset and self.input_dirty:
+                if not self.com.reset_input_buffer():
+                    return False
+                self.read_buffer.clear()
+                self.input_dirty = False
             # write command
             length = self.com.write(cmd)
             if len(cmd) == length:
                 return True
+            self.input_dirty = True
             return False
         except KeyboardInterrupt:
             raise
         except SerialTimeoutException:
-            self.logger.debug(f'{self.pre} Writing timeout')
+            self.input_dirty = True
+            self.metrics.count('timeouts')
+            self.logger.debug('%s Writing timeout', self.pre)
             return False
         except:
+            self.input_dirty = True
             log_exception(self.logger, f'{self.pre} Writing exception')
             return False
 
-    def _send_command(self, cmd, terminator=CR):
+    def _send_command(self, cmd, terminator=CR, reset=True):
         if not cmd.endswith(terminator):
             if isinstance(terminator, bytes):
                 cmd += terminator
@@ -284,27 +454,68 @@ class TDKLambda:
                 cmd += terminator[0]
         self.command = cmd
         self.response = b''
+        name = command_name(cmd)
+        self.timeout = self.timeouts.timeout(name)
         t0 = time.perf_counter()
         # write command
-        if not self.write(cmd):
-            self.logger.debug(f'{self.pre} Error during write')
+        if not self.write(cmd, reset):
+            self.metrics.record(name, time.perf_counter() - t0, False)
+            self.logger.debug('%s Error during write', self.pre)
             return False
         # read response (to CR by default)
         result = self.read_response(terminator)
         dt = time.perf_counter() - t0
-        self.logger.debug(f'{self.pre} %s -> %s %s %4.0f ms', cmd, self.response, result, dt * 1000.)
+        self.metrics.record(name, dt, result)
+        if result:
+            self.timeouts.sample(name, dt)
+        if self.quiet:
+            self.log_summary()
+        elif self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('%s %s -> %s %s %4.0f ms', self.pre, cmd, self.response, result, dt * 1000.)
         return result
 
+    def log_summary(self, force=False):
+        # aggregated transaction log for quiet mode, formatted once per LOG_SUMMARY_PERIOD
+        t = time.time()
+        if not force and t - self.log_summary_time < self.LOG_SUMMARY_PERIOD:
+            return
+        if not self.logger.isEnabledFor(logging.INFO):
+            self.log_summary_time = t
+            return
+        c1, (n1, s1), start = self.summary_totals()
+        if start != self.log_summary_start:
+            # metrics have been reset since the last summary, count from zero
+            c0, (n0, s0) = {}, (0, 0.0)
+        else:
+            c0, (n0, s0) = self.log_summary_counters, self.log_summary_latency
+        d = {k: c1[k] - c0.get(k, 0) for k in c1}
+        mean = (s1 - s0) / (n1 - n0) if n1 > n0 else float('nan')
+        self.logger.info('%s %d transactions in %.0f s, %d errors, %d retries, %d timeouts, %d ADR, '
+                         '%d suspends, mean %.1f ms, last %s -> %s', self.pre, d['transactions'],
+                         t - self.log_summary_time, d['errors'], d['retries'], d['timeouts'],
+                         d['adr_switches'], d['suspends'], mean, self.command, self.response)
+        self.log_summary_time = t
+        self.log_summary_counters = c1
+        self.log_summary_latency = (n1, s1)
+        self.log_summary_start = start
+
+    def summary_totals(self):
+        # consistent copy of metrics totals and start time of their accumulation
+        with self.metrics.lock:
+            return dict(self.metrics.counters), (self.metrics.latency.n, self.metrics.latency.sum), \
+                self.metrics.start_time
+
     def _set_addr(self):
         if not hasattr(self.com, 'current_addr'):
             self.com.current_addr = -1
-        result = self._send_command(b'ADR %d\r' % self.addr)
+        result = self._send_command(self.add_checksum(b'ADR %d\r' % self.addr))
         if result and self.check_response(b'OK'):
-            self.logger.debug(f'{self.pre} Address %d -> %d' % (self.com.current_addr, self.addr))
+            self.metrics.count('adr_switches')
+            self.logger.debug('%s Address %d -> %d', self.pre, self.com.current_addr, self.addr)
             self.com.current_addr = self.addr
             return True
         else:
-            self.logger.debug(f'{self.pre} Error address {self.com.current_addr} -> {self.addr} {self.response}')
+            self.logger.debug('%s Error address %s -> %s %s', self.pre, self.com.current_addr, self.addr, self.response)
             self.com.current_addr = -1
             return False
 
@@ -336,7 +547,12 @@ class TDKLambda:
     def read_bool(self, cmd):
         if not self.send_command(cmd):
             return None
-        response = self.response[:-1]
+        return self.parse_bool(self.response[:-1])
+
+    @staticmethod
+    def parse_bool(response):
+        if response is None:
+            return None
         if response.upper() in (b'ON', b'1'):
             return True
         if response.upper() in (b'OFF', b'0'):
@@ -352,47 +568,70 @@ class TDKLambda:
             return False
 
     # high level general command  ***************************
+    def unify_command(self, cmd):
+        cmd = cmd.upper().strip()
+        # convert str to bytes
+        if isinstance(cmd, str):
+            cmd = str.encode(cmd)
+        if not cmd.endswith(CR):
+            cmd += CR
+        # add checksum
+        return self.add_checksum(cmd)
+
+    def select(self):
+        # switch bus to device address, called with com.lock acquired
+        if not self.auto_addr or self.com.current_addr == self.addr:
+            return True
+        n = self.read_retries
+        while n > 0:
+            n -= 1
+            if n < self.read_retries - 1:
+                self.metrics.count('retries')
+            if self._set_addr():
+                return True
+        self.suspend()
+        self.response = b''
+        return False
+
+    def schedule(self, func, arg, query):
+        # execute func(self, arg) at the port BusScheduler thread and wait for the result.
+        # func is the method of the class, not self.func, so subclass wrappers are not executed twice
+        priority = READ_PRIORITY if query else WRITE_PRIORITY
+        return self.scheduler.submit(self, func, self, arg, priority=priority).result()
+
+    def is_query(self, cmd):
+        # read only command, executed after pending writes
+        if isinstance(cmd, str):
+            cmd = cmd.encode()
+        return b'?' in cmd
+
     def send_command(self, cmd) -> bool:
+        if self.scheduler is not None and not self.scheduler.in_worker():
+            return self.schedule(TDKLambda.send_command, cmd, self.is_query(cmd))
         if not self.ready:
             self.command = cmd
             self.response = b''
             return False
         try:
-            # unify command
-            cmd = cmd.upper().strip()
-            # convert str to bytes
-            if isinstance(cmd, str):
-                cmd = str.encode(cmd)
-            if not cmd.endswith(CR):
-                cmd += CR
-            # add checksum
-            cmd = self.add_checksum(cmd)
+            cmd = self.unify_command(cmd)
             with self.com.lock:
-                if self.auto_addr and self.com.current_addr != self.addr:
-                    n = self.read_retries
-                    while n > 0:
-                        n -= 1
-                        result = self._set_addr()
-                        if result:
-                            break
-                    if not result:
-                        self.suspend()
-                        self.response = b''
-                        return False
+                if not self.select():
+                    return False
                 result = self._send_command(cmd)
                 if result:
                     return True
-                self.logger.debug(f'{self.pre} Send command %s error' % cmd)
+                self.logger.debug('%s Send command %s error', self.pre, cmd)
                 n = self.read_retries
                 while n > 1:
                     n -= 1
+                    self.metrics.count('retries')
                     result = self._send_command(cmd)
                     if result:
                         return True
                     # self.logger.debug(f'{self.pre} Repeated send command %s error' % cmd)
                 self.suspend()
                 self.response = b''
-                self.logger.info(f'{self.pre} Can not send command %s' % cmd)
+                self.logger.info('%s Can not send command %s', self.pre, cmd)
                 return False
         except KeyboardInterrupt:
             raise
@@ -402,6 +641,47 @@ class TDKLambda:
             self.response = b''
             return False
 
+    def execute_batch(self, commands):
+        # executes commands for this address under one lock acquisition and one ADR,
+        # input buffer is reset only before the first command and after errors.
+        # Returns list of responses without CR, None for failed commands.
+        if self.scheduler is not None and not self.scheduler.in_worker():
+            return self.schedule(TDKLambda.execute_batch, commands, all(self.is_query(c) for c in commands))
+        results = [None] * len(commands)
+        if not self.ready:
+            self.response = b''
+            return results
+        try:
+            cmds = [self.unify_command(c) for c in commands]
+            with self.com.lock:
+                if not self.select():
+                    return results
+                reset = True
+                for i, cmd in enumerate(cmds):
+                    n = self.read_retries
+                    while n > 0:
+                        n -= 1
+                        if self._send_command(cmd, reset=reset):
+                            results[i] = self.response[:-1]
+                            reset = False
+                            break
+                        # clean input after failure
+                        reset = True
+                        if n > 0:
+                            self.metrics.count('retries')
+                    if results[i] is None:
+                        self.suspend()
+                        self.logger.info('%s Can not send command %s', self.pre, cmd)
+                        break
+            return results
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, f'{self.pre} Can not execute batch {commands}')
+            self.suspend()
+            self.response = b''
+            return results
+
     # high level read commands ***************************
     def add_checksum(self, cmd):
         if self.check:
@@ -457,20 +737,20 @@ class TDKLambda:
 
     def read_all(self):
         if not self.send_command(b'DVC?'):
-            return [float('Nan')] * 6
-        reply = self.response
-        sv = reply.split(b',')
-        vals = []
-        for s in sv:
-            try:
-                v = float(s)
-            except:
-                # self.logger.debug('%s is not a float', reply)
-                v = float('Nan')
-            vals.append(v)
-        if len(vals) <= 6:
-            vals = [*vals, *[float('Nan')] * 6]
-        return vals[:6]
+            return list(NAN_DVC)
+        return self.parse_all(self.response)
+
+    @staticmethod
+    def parse_all(reply):
+        # [voltage, programmed_voltage, current, programmed_current, ovp, uvl], NAN for missing reply
+        if not reply:
+            return list(NAN_DVC)
+        return parse_dvc(reply)
+
+    def read_status(self):
+        # measured and programmed values and output state in one batch
+        dvc, out = self.execute_batch([b'DVC?', b'OUT?'])
+        return self.parse_all(dvc), self.parse_bool(out)
 
     # high level write commands ***************************
     def write_output(self, value):
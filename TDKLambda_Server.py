@@ -5,6 +5,7 @@ import sys
 if '../TangoUtils' not in sys.path: sys.path.append('../TangoUtils')
 if '../IT6900' not in sys.path: sys.path.append('../IT6900')
 
+import json
 import logging
 import time
 from math import isnan
@@ -13,6 +14,12 @@ from tango import AttrQuality, AttrWriteType, DispLevel
 from tango import DevState
 from tango.server import attribute, command
 
+from AdaptiveTimeout import AdaptiveTimeout
+from ChainSweeper import ChainSweeper
+from ChangePublisher import ChangePublisher
+from DevicePoller import DevicePoller
+from HistoryBuffer import COLUMNS, HistoryBuffer
+from StartupOrchestrator import StartupOrchestrator
 from TDKLambda import TDKLambda, TDKLambda_SCPI
 from TangoServerPrototype import TangoServerPrototype
 
@@ -26,6 +33,11 @@ class TDKLambda_Server(TangoServerPrototype):
     server_version_value = APPLICATION_VERSION
     server_name_value = APPLICATION_NAME_SHORT
     READING_VALID_TIME = 1.0
+    POLL_PERIOD = 0.5
+    # history rows, 30 min at POLL_PERIOD
+    HISTORY_SIZE = 3600
+    # attribute name: index in read_all() values
+    EVENT_ATTRIBUTES = {'voltage': 0, 'programmed_voltage': 1, 'current': 2, 'programmed_current': 3}
 
     port = attribute(label="Port", dtype=str,
                      display_level=DispLevel.OPERATOR,
@@ -39,6 +51,12 @@ class TDKLambda_Server(TangoServerPrototype):
                         unit="", format="%s",
                         doc="TDKLambda address")
 
+    mean_latency = attribute(label="Mean latency", dtype=float,
+                             display_level=DispLevel.EXPERT,
+                             access=AttrWriteType.READ,
+                             unit="ms", format="%6.1f",
+                             doc="Mean serial transaction time, see read_metrics command for details")
+
     device_type = attribute(label="PS Type", dtype=str,
                             display_level=DispLevel.OPERATOR,
                             access=AttrWriteType.READ,
@@ -87,6 +105,7 @@ class TDKLambda_Server(TangoServerPrototype):
         self.values = [float('NaN')] * 6
         self.time = time.time() - 100.0
         self.READING_VALID_TIME = self.config.get('reading_valid_time', self.READING_VALID_TIME)
+        self.POLL_PERIOD = self.config.get('poll_period', self.POLL_PERIOD)
         # get port and address from property
         kwargs = {}
         port = self.config.get('port', 'COM3')
@@ -95,17 +114,74 @@ class TDKLambda_Server(TangoServerPrototype):
         kwargs['baudrate'] = baud
         kwargs['logger'] = self.logger
         kwargs['read_timeout'] = self.config.get('read_timeout', 1.0)
+        # adaptive read timeout between min_timeout and read_timeout
+        kwargs['adaptive_timeout'] = self.config.get('adaptive_timeout', False)
+        kwargs['min_timeout'] = self.config.get('min_timeout', AdaptiveTimeout.FLOOR)
+        # PortBroker address to share the port with other server processes, '' - direct access
+        kwargs['broker'] = self.config.get('broker', '')
+        # shared connection with keep-alive and reconnect backoff for host:port ports
+        kwargs['tcp_pool'] = self.config.get('tcp_pool', False)
+        # re-probe suspended device by background DeviceRecovery worker instead of inline in requests
+        kwargs['background_recovery'] = self.config.get('background_recovery', False)
         kwargs['read_retries'] = self.config.get('read_retries', 2)
+        # one summary log line per minute instead of one line per transaction
+        kwargs['quiet'] = self.config.get('quiet', False)
+        # skip full device probing at restart using identity saved on disk
+        kwargs['identity_cache'] = self.config.get('identity_cache', False)
+        # queue requests of all devices at the port to BusScheduler, writes before polling
+        kwargs['bus_scheduler'] = self.config.get('bus_scheduler', False)
         protocol = self.config.get('protocol', 'GEN')
         # create TDKLambda device
         if protocol == 'GEN':
+            # device probing is done by StartupOrchestrator, in parallel for different ports
+            kwargs['defer_init'] = True
             self.tdk = TDKLambda(port, addr, **kwargs)
         else:
             self.tdk = TDKLambda_SCPI(port, addr, **kwargs)
-        self.pre = f'{self.pre} {self.tdk.pre}'
         # add device to list
         # if self not in TDKLambda_Server.device_list:
         #     TDKLambda_Server.device_list[self.get_name()] = self
+        # change/archive events pushed from poller thread when value moves past deadband
+        self.publisher = ChangePublisher(self, self.config.get('abs_change', 0.0),
+                                         self.config.get('rel_change', 0.0), logger=self.logger)
+        try:
+            self.publisher.deadbands.update(json.loads(self.config.get('deadbands', '{}')))
+        except KeyboardInterrupt:
+            raise
+        except:
+            # wrong property value should not prevent device creation
+            self.log_exception('Wrong deadbands property, ignored')
+        for name in self.EVENT_ATTRIBUTES:
+            self.publisher.configure(name)
+        self.publisher.configure('output_state')
+        # measurement history filled by poller, history_size <= 0 disables it
+        history_size = self.config.get('history_size', self.HISTORY_SIZE)
+        self.history = HistoryBuffer(history_size, COLUMNS) if history_size > 0 else None
+        # background polling, attribute readers use poller snapshot only
+        if protocol == 'GEN' and self.config.get('chain_sweep', False):
+            # one sweeper thread per port reads all devices of the chain in address order
+            # output_every > 1 reads OUT? once per output_every sweeps, state changed not by our writes
+            # (OVP, front panel ...) is reported with delay
+            output_every = self.config.get('output_every', 1)
+            self.poller = ChainSweeper.get(port, self.POLL_PERIOD, logger=self.logger,
+                                           output_every=output_every).subscribe(
+                self.tdk, validate=self.poll_valid, callback=self.acquired)
+        else:
+            self.poller = DevicePoller(self.poll, self.POLL_PERIOD, name=f'{self.get_name()} poller',
+                                       logger=self.logger, validate=self.poll_valid,
+                                       callback=self.acquired)
+        if protocol == 'GEN':
+            StartupOrchestrator.submit(self.get_name(), port, self.tdk.init, callback=self.complete_init)
+        else:
+            self.complete_init()
+
+    def complete_init(self, result=None):
+        if self.poller.stopped.is_set():
+            # device was deleted during initialization
+            return
+        self.pre = f'{self.get_name()} {self.tdk.pre}'
+        self.poller.poll()
+        self.poller.start()
         # check if device OK
         if self.tdk.ready:
             if self.tdk.max_voltage < float('inf'):
@@ -125,6 +201,7 @@ class TDKLambda_Server(TangoServerPrototype):
             self.logger.error(msg)
 
     def delete_device(self):
+        self.poller.stop(2.0 * self.POLL_PERIOD + self.tdk.read_timeout)
         self.tdk.__del__()
         msg = f'{self.pre} device has been deleted'
         self.logger.info(msg)
@@ -152,9 +229,55 @@ class TDKLambda_Server(TangoServerPrototype):
             self.set_fault()
             return "Uninitialized"
 
+    def poll(self):
+        # executed in poller thread only
+        if isinstance(self.tdk, TDKLambda):
+            # DVC? and OUT? in one batch
+            return self.tdk.read_status()
+        values = self.tdk.read_all()
+        output = self.tdk.read_output()
+        return values, output
+
+    @staticmethod
+    def poll_valid(values):
+        return values[1] is not None and not all(isnan(v) for v in values[0][:4])
+
+    def acquired(self, snapshot):
+        # executed in poller thread only
+        self.record_history(snapshot)
+        self.publish_events(snapshot)
+
+    def record_history(self, snapshot):
+        if self.history is None or snapshot.values is None:
+            return
+        if snapshot.valid:
+            self.history.append(snapshot.time, snapshot.values[0][:4])
+        else:
+            self.history.append(snapshot.time, (float('nan'),) * 4)
+
+    def publish_events(self, snapshot):
+        # executed in poller thread only
+        if snapshot.values is None:
+            return
+        values, output = snapshot.values
+        for name, index in self.EVENT_ATTRIBUTES.items():
+            v = values[index] if snapshot.valid and not isnan(values[index]) else None
+            self.publisher.publish(name, v)
+        self.publisher.publish('output_state', output if snapshot.valid else None)
+
+    def snapshot(self):
+        snapshot = self.poller.snapshot
+        if snapshot.values is not None:
+            self.values = snapshot.values[0]
+            self.time = snapshot.time
+        valid = snapshot.valid and time.time() - snapshot.time <= max(self.READING_VALID_TIME,
+                                                                      2.0 * self.POLL_PERIOD)
+        return snapshot, valid
+
     def read_output_state(self):
-        value = self.tdk.read_output()
-        if value is not None:
+        snapshot, valid = self.snapshot()
+        value = snapshot.values[1] if snapshot.values is not None else None
+        if valid and value is not None:
             qual = AttrQuality.ATTR_VALID
             self.set_running()
         else:
@@ -167,28 +290,18 @@ class TDKLambda_Server(TangoServerPrototype):
         return value
 
     def read_all(self):
-        t0 = time.time()
-        try:
-            values = self.tdk.read_all()
-            self.values = values
-            self.time = time.time()
-            # msg = '%s:%d read_all %s ms %s' % \
-            #       (self.tdk.port, self.tdk.addr, int((self.time - t0) * 1000.0), values)
-            # self.logger.debug(msg)
-        except:
-            msg = f'{self.pre}  read_all error'
-            self.log_exception(msg)
-            self.set_fault(msg)
-
-    def read_voltage(self):
-        if time.time() - self.time > self.READING_VALID_TIME:
-            self.read_all()
-        val = self.values[0]
-        attr = self.voltage
+        # values from the latest poller snapshot, no serial I/O
+        snapshot, valid = self.snapshot()
+        if valid:
+            return self.values
+        return [float('NaN')] * 6
+
+    def read_snapshot_value(self, index, attr, name):
+        val = self.read_all()[index]
         attr.set_value(val)
         if isnan(val):
             attr.set_quality(AttrQuality.ATTR_INVALID)
-            msg = f'{self.pre}  Output voltage read error'
+            msg = f'{self.pre} {name} read error'
             self.logger.debug(msg)
             self.set_fault(msg)
         else:
@@ -196,60 +309,24 @@ class TDKLambda_Server(TangoServerPrototype):
             self.set_running()
         return val
 
+    def read_voltage(self):
+        return self.read_snapshot_value(0, self.voltage, 'Output voltage')
+
     def read_current(self):
-        if time.time() - self.time > self.READING_VALID_TIME:
-            self.read_all()
-        val = self.values[2]
-        attr = self.current
-        attr.set_value(val)
-        if isnan(val):
-            attr.set_quality(AttrQuality.ATTR_INVALID)
-            msg = f'{self.pre} Output current read error'
-            self.logger.debug(msg)
-            self.set_fault(msg)
-        else:
-            attr.set_quality(AttrQuality.ATTR_VALID)
-            self.set_running()
-        return val
+        return self.read_snapshot_value(2, self.current, 'Output current')
 
     def read_programmed_voltage(self):
-        # self.logger.info("enter %s", self.READING_VALID_TIME)
-        if time.time() - self.time > self.READING_VALID_TIME:
-            self.read_all()
-        val = self.values[1]
-        attr = self.programmed_voltage
-        attr.set_value(val)
-        if isnan(val):
-            attr.set_quality(AttrQuality.ATTR_INVALID)
-            msg = f'{self.pre} Programmed voltage read error'
-            self.logger.debug(msg)
-            self.set_fault(msg)
-        else:
-            attr.set_quality(AttrQuality.ATTR_VALID)
-            self.set_running()
-        return val
+        return self.read_snapshot_value(1, self.programmed_voltage, 'Programmed voltage')
 
     def read_programmed_current(self):
-        if time.time() - self.time > self.READING_VALID_TIME:
-            self.read_all()
-        val = self.values[3]
-        attr = self.programmed_current
-        attr.set_value(val)
-        if isnan(val):
-            attr.set_quality(AttrQuality.ATTR_INVALID)
-            msg = f'{self.pre} Programmed current read error'
-            self.logger.debug(msg)
-            self.set_fault(msg)
-        else:
-            attr.set_quality(AttrQuality.ATTR_VALID)
-            self.set_running()
-        return val
+        return self.read_snapshot_value(3, self.programmed_current, 'Programmed current')
 
     def write_output_state(self, value):
         if self.tdk.write_output(value):
             self.output_state.set_quality(AttrQuality.ATTR_VALID)
             self.output_state.set_value(value)
             self.output_state.set_write_value(value)
+            self.poller.refresh()
             self.set_running()
             return True
         else:
@@ -265,6 +342,7 @@ class TDKLambda_Server(TangoServerPrototype):
             self.programmed_voltage.set_quality(AttrQuality.ATTR_VALID)
             self.programmed_voltage.set_value(value)
             self.programmed_voltage.set_write_value(value)
+            self.poller.refresh()
             self.set_running()
         else:
             self.programmed_voltage.set_quality(AttrQuality.ATTR_INVALID)
@@ -279,6 +357,7 @@ class TDKLambda_Server(TangoServerPrototype):
             self.programmed_current.set_quality(AttrQuality.ATTR_VALID)
             self.programmed_current.set_value(value)
             self.programmed_current.set_write_value(value)
+            self.poller.refresh()
             self.set_running()
         else:
             self.programmed_current.set_quality(AttrQuality.ATTR_INVALID)
@@ -295,6 +374,32 @@ class TDKLambda_Server(TangoServerPrototype):
                 msg = f'{self.pre} was not initialized'
         super().set_fault(msg)
 
+    def read_mean_latency(self):
+        return self.tdk.metrics.mean_latency()
+
+    @command(dtype_in=None, dtype_out=str,
+             doc_out='JSON transaction metrics: latency histograms per command, retries, timeouts, ADR switches, suspends')
+    def read_metrics(self):
+        return self.tdk.metrics.as_json()
+
+    @command(dtype_in=None, dtype_out=None, doc_out='Reset transaction metrics')
+    def reset_metrics(self):
+        self.tdk.metrics.reset()
+
+    @command(dtype_in=None, dtype_out=str,
+             doc_out='JSON learned read timeouts: latency estimates and timeout per command class')
+    def read_timeouts(self):
+        return self.tdk.timeouts.as_json()
+
+    @command(dtype_in=float, doc_in='Time window, seconds back from now',
+             dtype_out=[float], doc_out='History rows (time, voltage, programmed_voltage, current, '
+                                        'programmed_current) flattened row by row, NaN for invalid readings')
+    def read_history(self, seconds):
+        # from memory only, no serial I/O
+        if self.history is None:
+            return []
+        return self.history.last(seconds).ravel()
+
     @command(doc_in='Reset power supply by sending RST command',
              dtype_out=str, doc_out='Response from TDKLambda PS without final <CR>')
     def reset_ps(self):
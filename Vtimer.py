@@ -9,6 +9,9 @@ APPLICATION_VERSION = '1.0'
 
 
 class Vtimer(ModbusDevice):
+    CHANNELS = 12
+    MAX_READ_REGISTERS = 125
+
     def __init__(self, port: str, addr: int, **kwargs):
         super().__init__(port, addr, **kwargs)
         self.id = 'Timer'
@@ -23,14 +26,17 @@ class Vtimer(ModbusDevice):
             self.duration = 1
             self.mode = 0
             self.output = 1
+            self.span_read = True
+        # time of the last successful read_channels
+        self.channels_time = 0.0
         v = self.modbus_write(0, self.config['settings'])
         if v != 5:
-            self.debug(f'Settings initialization error')
+            self.debug('Settings initialization error')
             errors += 1
         for i in range(1, 13):
             v = self.modbus_write(16 * i, self.config['channels'][i])
             if v != 8:
-                self.debug(f'Channel {i} initialization error')
+                self.debug('Channel %s initialization error', i)
                 errors += 1
         if errors == 0:
             self.initialized = True
@@ -39,22 +45,13 @@ class Vtimer(ModbusDevice):
             self.initialized = False
             self.info('has been initialized with errors')
 
-    @property
-    def ready(self):
-        if time.time() < self.suspend_to:
+    def restore(self):
+        # replay mode and channel table, one FC16 write per channel and duration
+        if not self.initialized:
             return False
-        # was suspended try to init
-        if self.suspend_to > 0.0:
-            self.__del__()
-            self.__init__(self.port, self.addr, **self.kwargs)
-            if self.initialized:
-                self.write_duration(self.duration)
-                self.write_mode(self.mode)
-                for i in range(12):
-                    self.write_channel_stop(i + 1, self.stop[i])
-                    self.write_channel_start(i + 1, self.start[i])
-                    self.write_channel_enable(i + 1, self.enable[i])
-        return self.suspend_to <= 0.0
+        result = self.write_mode(self.mode)
+        channels = [(self.enable[i], self.start[i], self.stop[i]) for i in range(self.CHANNELS)]
+        return self.write_table(channels, force=True) and result
 
     def read_channel_start(self, n: int) -> int:
         delay = self.modbus_read(16 * n + 1, 2)
@@ -80,18 +77,48 @@ class Vtimer(ModbusDevice):
         else:
             return -1
 
-    def read_channel(self, n: int) -> [int]:
-        result = self.modbus_read(16 * n, 5)
-        if len(result) != 5:
-            return []
-        s1 = result[0]
+    def _decode_channel(self, n: int, data) -> [int]:
+        s1 = data[0]
         self.enable[n - 1] = s1
-        s2 = result[1] * 0x10000 + result[2]
+        s2 = data[1] * 0x10000 + data[2]
         self.start[n - 1] = s2
-        s3 = result[3] * 0x10000 + result[4]
+        s3 = data[3] * 0x10000 + data[4]
         self.stop[n - 1] = s3
         return [s1, s2, s3]
 
+    def read_channel(self, n: int) -> [int]:
+        result = self.modbus_read(16 * n, 5)
+        if len(result) != 5:
+            return []
+        return self._decode_channel(n, result)
+
+    def read_channels(self, max_age: float = 0.0) -> bool:
+        # fill enable, start and stop for all channels with as few transactions as possible
+        if time.time() - self.channels_time <= max_age:
+            return True
+        n = 1
+        while n <= self.CHANNELS:
+            # block of channel m ends at register 16 * m + 4
+            m = n
+            if self.span_read:
+                m = min(self.CHANNELS, n + (self.MAX_READ_REGISTERS - 5) // 16)
+            length = 16 * (m - n) + 5
+            data = self.modbus_read(16 * n, length) if m > n else []
+            if len(data) == length:
+                for k in range(n, m + 1):
+                    self._decode_channel(k, data[16 * (k - n):16 * (k - n) + 5])
+            else:
+                if m > n and 0 < self.error < 256:
+                    # device exception (e.g. illegal address in the gaps), use channel reads
+                    self.debug('Spanning channels read rejected, error %d', self.error)
+                    self.span_read = False
+                for k in range(n, m + 1):
+                    if not self.read_channel(k):
+                        return False
+            n = m + 1
+        self.channels_time = time.time()
+        return True
+
     def read_run(self) -> int:
         data = self.modbus_read(0, 1)
         if data:
@@ -180,6 +207,37 @@ class Vtimer(ModbusDevice):
         self.enable[n - 1] = v
         return True
 
+    def write_table(self, channels, force=False) -> bool:
+        # channels: {n: (enable, start, stop)} with n = 1..12 or list of 12 (enable, start, stop) or None.
+        # Only registers differing from cached state are written, one FC16 write per changed channel block,
+        # script duration is updated once at the end.
+        if not isinstance(channels, dict):
+            channels = {i + 1: c for i, c in enumerate(channels) if c is not None}
+        result = True
+        for n in sorted(channels):
+            enable, start, stop = channels[n]
+            image = [int(bool(enable)), start // 0x10000, start % 0x10000, stop // 0x10000, stop % 0x10000]
+            old = [int(bool(self.enable[n - 1])),
+                   self.start[n - 1] // 0x10000, self.start[n - 1] % 0x10000,
+                   self.stop[n - 1] // 0x10000, self.stop[n - 1] % 0x10000]
+            changed = [i for i in range(5) if force or image[i] != old[i]]
+            if not changed:
+                continue
+            # unchanged registers inside the run are rewritten with the same values
+            first = changed[0]
+            last = changed[-1] + 1
+            if self.modbus_write(16 * n + first, image[first:last]) != last - first:
+                self.debug('Channel %s table write error', n)
+                result = False
+                continue
+            self.enable[n - 1] = image[0]
+            self.start[n - 1] = start
+            self.stop[n - 1] = stop
+        ms = max(self.stop)
+        if self.duration != ms or force:
+            result = self.write_duration(ms) and result
+        return result
+
     def enable_channel(self, n: int) -> bool:
         return self.write_channel_enable(n, 1)
 
@@ -261,10 +319,7 @@ if __name__ == "__main__":
     n = 500
     v0 = ot1.write_output(1)
     # v1 = ot1.write_duration(12 * n + 1)
-    for i in range(1, 13):
-        v3 = ot1.write_channel_stop(i, i * n)
-        v2 = ot1.write_channel_start(i, (i - 1) * n)
-        v6 = ot1.enable_channel(i)
+    v3 = ot1.write_table({i: (1, (i - 1) * n, i * n) for i in range(1, 13)})
     v8 = ot1.write_run(3)
     v = ot1.write_run(1)
     f = ot1.read_fault()
@@ -15,6 +15,7 @@ from tango import AttrQuality, AttrWriteType, DispLevel
 from tango import DevState
 from tango.server import attribute, command
 
+from AdaptiveTimeout import AdaptiveTimeout
 from TangoServerPrototype import TangoServerPrototype
 from Vtimer import Vtimer
 
@@ -26,6 +27,7 @@ APPLICATION_VERSION = '1.3'
 DEFAULT_PORT = 'COM17'
 DEFAULT_ADDRESS = 1
 DEFAULT_READ_TIMEOUT = 1.0
+DEFAULT_CHANNELS_VALID_TIME = 0.5
 
 
 class VtimerServer(TangoServerPrototype):
@@ -51,6 +53,12 @@ class VtimerServer(TangoServerPrototype):
                             unit="", format="%s",
                             doc="Vtimer device type")
 
+    mean_latency = attribute(label="Mean latency", dtype=float,
+                             display_level=DispLevel.EXPERT,
+                             access=AttrWriteType.READ,
+                             unit="ms", format="%6.1f",
+                             doc="Mean serial transaction time, see read_metrics command for details")
+
     # endregion
 
     # region ---------------- custom attributes --------------
@@ -358,6 +366,17 @@ class VtimerServer(TangoServerPrototype):
         addr = self.config.get('addr', DEFAULT_ADDRESS)
         kwargs['logger'] = self.logger
         kwargs['read_timeout'] = self.config.get('read_timeout', DEFAULT_READ_TIMEOUT)
+        # adaptive read timeout between min_timeout and read_timeout
+        kwargs['adaptive_timeout'] = self.config.get('adaptive_timeout', False)
+        kwargs['min_timeout'] = self.config.get('min_timeout', AdaptiveTimeout.FLOOR)
+        # PortBroker address to share the port with other server processes, '' - direct access
+        kwargs['broker'] = self.config.get('broker', '')
+        # shared connection with keep-alive and reconnect backoff for host:port ports
+        kwargs['tcp_pool'] = self.config.get('tcp_pool', False)
+        # re-probe suspended device by background DeviceRecovery worker instead of inline in requests
+        kwargs['background_recovery'] = self.config.get('background_recovery', False)
+        # channel attributes are served from channel cache not older than this
+        self.channels_valid_time = self.config.get('channels_valid_time', DEFAULT_CHANNELS_VALID_TIME)
         # create Vtimer device
         self.tmr = Vtimer(port, addr, **kwargs)
         self.pre = f'{self.get_name()} {self.tmr.pre}'
@@ -412,6 +431,9 @@ class VtimerServer(TangoServerPrototype):
             self.set_fault()
             return "Uninitialized"
 
+    def read_mean_latency(self):
+        return self.tmr.metrics.mean_latency()
+
     # endregion
 
     # region ---------------- custom attributes read --------------
@@ -502,9 +524,14 @@ class VtimerServer(TangoServerPrototype):
         self.set_fault(msg)
         return False
 
+    def read_channel_cache(self, n, values):
+        if self.tmr.read_channels(self.channels_valid_time):
+            return values[n]
+        return -1
+
     def read_channel_n(self, n):
         name = f'channel_enable{n}'
-        value = self.tmr.read_channel_enable(n + 1)
+        value = self.read_channel_cache(n, self.tmr.enable)
         if value >= 0:
             getattr(self, name).set_quality(AttrQuality.ATTR_VALID)
             self.set_running()
@@ -516,7 +543,7 @@ class VtimerServer(TangoServerPrototype):
 
     def read_pulse_start_n(self, n):
         name = f'pulse_start{n}'
-        value = self.tmr.read_channel_start(n + 1)
+        value = self.read_channel_cache(n, self.tmr.start)
         if value >= 0:
             getattr(self, name).set_quality(AttrQuality.ATTR_VALID)
             return value
@@ -527,7 +554,7 @@ class VtimerServer(TangoServerPrototype):
 
     def read_pulse_stop_n(self, n):
         name = f'pulse_stop{n}'
-        value = self.tmr.read_channel_stop(n + 1)
+        value = self.read_channel_cache(n, self.tmr.stop)
         if value >= 0:
             getattr(self, name).set_quality(AttrQuality.ATTR_VALID)
             # self.logger.debug('read %d %s', n, value)
@@ -861,6 +888,20 @@ class VtimerServer(TangoServerPrototype):
 
     # region ---------------- custom commands --------------
 
+    @command(dtype_in=None, dtype_out=str,
+             doc_out='JSON transaction metrics: latency histograms per command, retries, timeouts, ADR switches, suspends')
+    def read_metrics(self):
+        return self.tmr.metrics.as_json()
+
+    @command(dtype_in=None, dtype_out=None, doc_out='Reset transaction metrics')
+    def reset_metrics(self):
+        self.tmr.metrics.reset()
+
+    @command(dtype_in=None, dtype_out=str,
+             doc_out='JSON learned read timeouts: latency estimates and timeout per command class')
+    def read_timeouts(self):
+        return self.tmr.timeouts.as_json()
+
     @command(dtype_in=None, doc_in='Start timer pulse',
              dtype_out=bool, doc_out='True if success')
     def start_pulse(self):